@@ -0,0 +1,249 @@
+import argparse
+import time
+import numpy as np
+import torch
+from models import networks
+from models import cpu_executor
+import util.util as util
+
+# (name, input channels, output channels, input resolution, upsample) of the modulated convs in
+# StyledDecoder with the default options (ngf=64, n_downsample=2, fineSize=256)
+DECODER_MODULATED_CONVS = [
+    ('StyledConvBlock_0.conv0', 256, 256, 64, False),
+    ('StyledConvBlock_up0.conv0', 256, 128, 64, True),
+    ('StyledConvBlock_up0.conv1', 128, 128, 128, False),
+    ('StyledConvBlock_up1.conv0', 128, 64, 128, True),
+    ('StyledConvBlock_up1.conv1', 64, 64, 256, False),
+]
+
+
+def time_call(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    start = time.time()
+    for _ in range(repeats):
+        fn()
+    return (time.time() - start) / repeats
+
+
+def benchmark_modconv(args):
+    # compares the grouped conv and the shared weight formulations of ModulatedConv2d
+    # at traversal batch sizes on random weights
+    device = torch.device(args.device)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    print('%-28s %6s %12s %12s %8s %10s' % ('layer', 'batch', 'grouped(ms)', 'shared(ms)', 'speedup', 'max diff'))
+    for name, fin, fout, size, upsample in DECODER_MODULATED_CONVS:
+        layer = networks.ModulatedConv2d(fin, fout, 3, upsample=upsample, latent_dim=256, normalize_mlp=True).to(device).eval()
+        for b in batch_sizes:
+            input = torch.randn(b, fin, size, size, device=device)
+            latent = torch.randn(b, 256, device=device)
+            results = {}
+            timings = {}
+            with torch.no_grad():
+                for impl in ['grouped', 'shared']:
+                    layer.impl = impl
+
+                    def run():
+                        results[impl] = layer(input, latent)
+                        if device.type == 'cuda':
+                            torch.cuda.synchronize()
+
+                    timings[impl] = time_call(run, args.repeats) * 1000
+
+            max_diff = (results['grouped'] - results['shared']).abs().max().item()
+            print('%-28s %6d %12.2f %12.2f %7.2fx %10.2e' % (name, b, timings['grouped'], timings['shared'],
+                                                          timings['grouped'] / timings['shared'], max_diff))
+
+
+def benchmark_styles(args):
+    # compares running mlp_class_std + demodulation per layer with the fused projection of
+    # StyledDecoder.project_styles and with a style cache hit, on random weights
+    device = torch.device(args.device)
+    decoder = networks.StyledDecoder(3, ngf=64, style_dim=50, n_downsampling=2, use_pixel_norm=True,
+                                     normalize_mlp=True, modulated_conv=True).to(device).eval()
+    convs = decoder.modulated_convs()
+    decoder.enable_style_cache()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    print('%6s %14s %12s %12s %10s' % ('batch', 'per layer(ms)', 'fused(ms)', 'cached(ms)', 'max diff'))
+    for b in batch_sizes:
+        latent = torch.randn(b, 256, device=device)
+        results = {}
+        with torch.no_grad():
+            def per_layer():
+                results['per_layer'] = [conv.modulation(conv.style_linear()(latent)) for conv in convs]
+
+            def fused():
+                results['fused'] = decoder.project_styles(latent)
+
+            def cached():
+                decoder.precompute_styles(latent)
+
+            per_layer_time = time_call(per_layer, args.repeats) * 1000
+            fused_time = time_call(fused, args.repeats) * 1000
+            cached_time = time_call(cached, args.repeats) * 1000
+
+        max_diff = max((s0 - s1).abs().max().item() for (s0, _), (s1, _) in zip(results['per_layer'], results['fused']))
+        max_diff = max([max_diff] + [(d0 - d1).abs().max().item() for (_, d0), (_, d1) in zip(results['per_layer'], results['fused'])])
+        print('%6d %14.3f %12.3f %12.3f %10.2e' % (b, per_layer_time, fused_time, cached_time, max_diff))
+
+
+def build_generator(device, checkpoint=''):
+    # a generator with the default LATS options and random weights, or the weights of a
+    # saved generator checkpoint (e.g. checkpoints/males_model/latest_net_g_running.pth)
+    netG = networks.Generator(3, 3, ngf=64, style_dim=50, n_downsampling=2, id_enc_norm=networks.PixelNorm,
+                              conv_weight_norm=True, decoder_norm='pixel', normalize_mlp=True,
+                              modulated_conv=True)
+    if checkpoint:
+        netG.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+    return netG.to(device).eval()
+
+
+# define_G arguments of the generator of build_generator, used by the worker processes of benchmark_workers
+GENERATOR_KWARGS = dict(input_nc=3, output_nc=3, ngf=64, style_dim=50, id_enc_norm='pixel', conv_weight_norm=True,
+                        decoder_norm='pixel', normalize_mlp=True, modulated_conv=True)
+
+
+def benchmark_freeze(args):
+    # compares the training graph with freeze_for_inference on a traversal of random keyframes
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    netG = build_generator(device, args.checkpoint)
+    frozen = build_generator(device)
+    frozen.load_state_dict(netG.state_dict())
+    networks.freeze_for_inference(frozen)
+
+    input = torch.randn(1, 3, args.size, args.size, device=device)
+    keyframes = torch.randn(6, 256, device=device)
+    results = {}
+    timings = {}
+    with torch.no_grad():
+        for name, model in [('eager', netG), ('frozen', frozen)]:
+            def run():
+                results[name] = model.infer(input, None, traverse=True, interp_step=args.interp_step, target_latent=keyframes)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+
+            timings[name] = time_call(run, args.repeats) * 1000
+
+    max_diff = (results['eager'] - results['frozen']).abs().max().item()
+    print('%8s %12s %12s %8s %10s' % ('frames', 'eager(ms)', 'frozen(ms)', 'speedup', 'max diff'))
+    print('%8d %12.2f %12.2f %7.2fx %10.2e' % (results['eager'].shape[0], timings['eager'], timings['frozen'],
+                                              timings['eager'] / timings['frozen'], max_diff))
+
+
+def benchmark_precision(args):
+    # renders a traversal in fp32 and in the reduced inference precisions and reports the uint8 pixel differences
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    netG = networks.freeze_for_inference(build_generator(device, args.checkpoint))
+    input = torch.rand(1, 3, args.size, args.size, device=device) * 2 - 1
+    # per class W of the (noise free) age conditions, one-hot blocks of gen_dim_per_style=50 entries
+    num_classes = 6
+    conditions = torch.zeros(num_classes, 50 * num_classes, device=device)
+    for i in range(num_classes):
+        conditions[i, i * 50:(i + 1) * 50] = 1
+    with torch.no_grad():
+        keyframes = netG.map_styles(conditions)
+
+    frames = {}
+    timings = {}
+    for precision in ['fp32'] + args.precisions.split(','):
+        def run():
+            with torch.no_grad(), networks.autocast(device.type, precision):
+                frames[precision] = netG.infer(input, None, traverse=True, interp_step=args.interp_step, target_latent=keyframes)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+
+        timings[precision] = time_call(run, args.repeats) * 1000
+        frames[precision] = util.tensor2im(frames[precision]).astype(np.int32)
+
+    print('%10s %10s %8s %14s %15s' % ('precision', 'time(ms)', 'speedup', 'max uint8 diff', 'mean uint8 diff'))
+    for precision in frames:
+        diff = np.abs(frames[precision] - frames['fp32'])
+        print('%10s %10.1f %7.2fx %14d %15.3f' % (precision, timings[precision], timings['fp32'] / timings[precision],
+                                                   diff.max(), diff.mean()))
+
+
+def benchmark_workers(args):
+    # renders a traversal of random keyframes in this process and with pools of cpu worker processes
+    # (cpu_executor.ShardedGenerator), and reports the speedup and the max uint8 difference of the frames
+    torch.manual_seed(0)
+    netG = networks.freeze_for_inference(build_generator(torch.device('cpu'), args.checkpoint))
+    netG.decoder.enable_style_cache()
+    input = torch.rand(1, 3, args.size, args.size) * 2 - 1
+    keyframes = torch.randn(6, 256)
+    latent = networks.interpolate_latents(keyframes, *networks.traversal_schedule(6, args.interp_step))
+
+    with torch.no_grad():
+        reference = util.tensor2im(netG.infer(input, None, deploy=True, target_latent=latent)).astype(np.int32)
+        single_time = time_call(lambda: netG.infer(input, None, deploy=True, target_latent=latent), args.repeats) * 1000
+
+    print('%8s %8s %10s %8s %14s' % ('frames', 'workers', 'time(ms)', 'speedup', 'max uint8 diff'))
+    print('%8d %8d %10.1f %7.2fx %14d' % (latent.shape[0], 1, single_time, 1.0, 0))
+    for num_workers in [int(n) for n in args.workers.split(',')]:
+        executor = cpu_executor.ShardedGenerator(netG, GENERATOR_KWARGS, num_workers)
+        try:
+            with torch.no_grad():
+                # the first traversal also waits for the workers to start
+                frames = executor.infer(input, None, deploy=True, target_latent=latent)
+                elapsed = time_call(lambda: executor.infer(input, None, deploy=True, target_latent=latent),
+                                    args.repeats, warmup=0) * 1000
+        finally:
+            executor.close()
+        max_diff = np.abs(util.tensor2im(frames).astype(np.int32) - reference).max()
+        print('%8d %8d %10.1f %7.2fx %14d' % (latent.shape[0], num_workers, elapsed, single_time / elapsed, max_diff))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='inference micro benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    modconv_parser = subparsers.add_parser('modconv', help='grouped vs shared weight modulated conv')
+    modconv_parser.add_argument('--batch_sizes', type=str, default='1,6,11,21,51', help='comma separated batch sizes (number of traversal frames)')
+    modconv_parser.add_argument('--repeats', type=int, default=3, help='timed repetitions per measurement')
+    modconv_parser.add_argument('--device', type=str, default='cpu', help='cpu, cuda, cuda:1, ...')
+    modconv_parser.add_argument('--threads', type=int, default=0, help='number of intra-op threads, 0 keeps the torch default')
+    modconv_parser.set_defaults(func=benchmark_modconv)
+
+    styles_parser = subparsers.add_parser('styles', help='per layer vs fused style projection and style cache')
+    styles_parser.add_argument('--batch_sizes', type=str, default='1,6,11,21,51,101', help='comma separated batch sizes (number of traversal frames)')
+    styles_parser.add_argument('--repeats', type=int, default=20, help='timed repetitions per measurement')
+    styles_parser.add_argument('--device', type=str, default='cpu', help='cpu, cuda, cuda:1, ...')
+    styles_parser.add_argument('--threads', type=int, default=0, help='number of intra-op threads, 0 keeps the torch default')
+    styles_parser.set_defaults(func=benchmark_styles)
+
+    freeze_parser = subparsers.add_parser('freeze', help='training graph vs frozen inference generator')
+    freeze_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint to load, random weights if not given')
+    freeze_parser.add_argument('--interp_step', type=float, default=0.5, help='traversal step between keyframes')
+    freeze_parser.add_argument('--size', type=int, default=256, help='input resolution')
+    freeze_parser.add_argument('--repeats', type=int, default=3, help='timed repetitions per measurement')
+    freeze_parser.add_argument('--device', type=str, default='cpu', help='cpu, cuda, cuda:1, ...')
+    freeze_parser.add_argument('--threads', type=int, default=0, help='number of intra-op threads, 0 keeps the torch default')
+    freeze_parser.set_defaults(func=benchmark_freeze)
+
+    precision_parser = subparsers.add_parser('precision', help='fp32 vs fp16/bf16 autocast inference, max uint8 difference of traversal frames')
+    precision_parser.add_argument('--precisions', type=str, default='bf16', help='comma separated reduced precisions to compare with fp32 (fp16 requires cuda)')
+    precision_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint to load, random weights if not given')
+    precision_parser.add_argument('--interp_step', type=float, default=0.2, help='traversal step between keyframes')
+    precision_parser.add_argument('--size', type=int, default=256, help='input resolution')
+    precision_parser.add_argument('--repeats', type=int, default=3, help='timed repetitions per measurement')
+    precision_parser.add_argument('--device', type=str, default='cpu', help='cpu, cuda, cuda:1, ...')
+    precision_parser.add_argument('--threads', type=int, default=0, help='number of intra-op threads, 0 keeps the torch default')
+    precision_parser.set_defaults(func=benchmark_precision)
+
+    workers_parser = subparsers.add_parser('workers', help='single process vs cpu worker processes for a traversal')
+    workers_parser.add_argument('--workers', type=str, default='2,4,8', help='comma separated numbers of worker processes')
+    workers_parser.add_argument('--checkpoint', type=str, default='', help='generator checkpoint to load, random weights if not given')
+    workers_parser.add_argument('--interp_step', type=float, default=0.05, help='traversal step between keyframes')
+    workers_parser.add_argument('--size', type=int, default=256, help='input resolution')
+    workers_parser.add_argument('--repeats', type=int, default=3, help='timed repetitions per measurement')
+    workers_parser.add_argument('--threads', type=int, default=0, help='number of intra-op threads of this process, 0 keeps the torch default')
+    workers_parser.set_defaults(func=benchmark_workers)
+
+    args = parser.parse_args()
+    if getattr(args, 'threads', 0) > 0:
+        torch.set_num_threads(args.threads)
+    if not hasattr(args, 'func'):
+        parser.print_help()
+    else:
+        args.func(args)
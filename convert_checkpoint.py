@@ -0,0 +1,74 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import time
+import scipy # this is to prevent a potential error caused by importing torch before scipy (happens due to a bad combination of torch & scipy versions)
+import torch
+from options.test_options import TestOptions
+from data.data_loader import CreateDataLoader
+from models.models import create_model
+from models import networks
+from models import tensor_file
+
+# converts the generator checkpoint used at test time (which_epoch, g_running or G) into a memory mappable
+# tensor file next to it. the inference only generator is stored, frozen for inference unless --no_freeze
+# is given, in --checkpoint_dtype. InferenceModel loads the converted file instead of the .pth when it exists
+
+
+def convert(opt, model):
+    # writes the tensor file of the generator of model (loaded from the .pth checkpoint) and returns its path
+    label = 'g_running' if model.use_moving_avg else 'G'
+    netG = model.netG
+    dtype = networks.PRECISIONS.get(opt.checkpoint_dtype)
+    state_dict = netG.state_dict()
+    if dtype is not None:
+        state_dict = dict((k, v.to(dtype) if v.is_floating_point() else v) for k, v in state_dict.items())
+
+    metadata = {'format': 'pt', 'label': label, 'frozen': 'true' if getattr(netG, 'frozen', False) else 'false',
+                'dtype': opt.checkpoint_dtype, 'source': '%s_net_%s.pth' % (opt.which_epoch, label)}
+    path = os.path.join(model.save_dir, '%s_net_%s%s' % (opt.which_epoch, label, tensor_file.EXTENSION))
+    tensor_file.save(path, state_dict, metadata)
+    return path
+
+
+def max_difference(model, converted_model):
+    # max difference between the deploy mode frames of both models on a random image
+    torch.manual_seed(0)
+    image = torch.rand(1, model.opt.input_nc, model.opt.fineSize, model.opt.fineSize) * 2 - 1
+    with torch.no_grad():
+        latent = model.class_latents()
+        out = model.netG.infer(image, None, deploy=True, target_latent=latent)
+        converted_out = converted_model.netG.infer(image, None, deploy=True, target_latent=latent)
+    return (converted_out - out).abs().max().item()
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse(save=False)
+    opt.nThreads = 1
+    opt.batchSize = 1
+    opt.serial_batches = True
+    opt.no_flip = True
+    opt.load_format = 'pth'
+    opt.quantize = ''
+    opt.backend = 'eager'
+    opt.cpu_workers = 0
+    opt.gpu_ids = []
+    opt.device = 'cpu'
+
+    # the dataset sets opt.numClasses, which the model is built with
+    data_loader = CreateDataLoader(opt)
+
+    model = create_model(opt)
+    path = convert(opt, model)
+    print('saved %s (%d tensors, %.1f MB)' % (path, len(model.netG.state_dict()), os.path.getsize(path) / 1024.0 / 1024.0))
+
+    # compare cold load times of both formats and the outputs of the converted weights
+    opt.load_format = 'pth'
+    start = time.time()
+    create_model(opt)
+    pth_time = time.time() - start
+    opt.load_format = 'auto'
+    start = time.time()
+    converted_model = create_model(opt)
+    print('model load time: pth %.2fs, %s %.2fs' % (pth_time, tensor_file.EXTENSION, time.time() - start))
+    print('max output difference: %.2e' % max_difference(model, converted_model))
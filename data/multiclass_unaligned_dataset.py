@@ -98,7 +98,7 @@ class MulticlassUnalignedDataset(BaseDataset):
         self.transform = get_transform(opt)
 
         if (not self.opt.isTrain) and self.in_the_wild:
-            self.preprocessor = preprocessInTheWildImage(out_size=opt.fineSize)
+            self.preprocessor = preprocessInTheWildImage(out_size=opt.fineSize, device=opt.device)
 
     def set_sample_mode(self, mode=False):
         self.get_samples = mode
@@ -179,6 +179,18 @@ class MulticlassUnalignedDataset(BaseDataset):
         
         return result
 
+    def get_items_from_paths(self, paths):
+        # batched get_item_from_path for traverse/deploy inference over several images
+        items = [self.get_item_from_path(path) for path in paths]
+        result = {'Imgs': torch.cat([item['Imgs'] for item in items], 0),
+                  'Paths': [item['Paths'][0] for item in items],
+                  'Classes': torch.cat([item['Classes'] for item in items], 0),
+                  'Valid': [item['Valid'] for item in items]}
+        if all('Original_Img_For_Paper' in item for item in items):
+            result['Original_Img_For_Paper'] = [item['Original_Img_For_Paper'] for item in items]
+
+        return result
+
     def __getitem__(self, index):
         if self.opt.isTrain and not self.get_samples:
             condition = True
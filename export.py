@@ -0,0 +1,124 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import time
+import inspect
+import scipy # this is to prevent a potential error caused by importing torch before scipy (happens due to a bad combination of torch & scipy versions)
+import numpy as np
+import torch
+import torch.nn as nn
+from options.test_options import TestOptions
+from data.data_loader import CreateDataLoader
+from models.models import create_model
+from models import networks
+from models import onnx_backend
+import util.util as util
+
+
+class DecoderGraph(nn.Module):
+    # exposes InferenceGraph.decode as forward for torch.onnx.export
+    def __init__(self, graph):
+        super(DecoderGraph, self).__init__()
+        self.graph = graph
+
+    def forward(self, id_features, latent):
+        return self.graph.decode(id_features, latent)
+
+
+def onnx_export_kwargs():
+    # the TorchScript based exporter is used on every torch version. torch releases with the dynamo
+    # exporter accept a dynamo keyword (and may default to it), older releases do not know it
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        return {'dynamo': False}
+    return {}
+
+
+def export(opt, model, out_dir):
+    graph = networks.InferenceGraph(model.netG).eval()
+    image = torch.rand(1, opt.input_nc, opt.fineSize, opt.fineSize, device=model.device) * 2 - 1
+    latent = model.class_latents()[:2]
+
+    export_kwargs = onnx_export_kwargs()
+    with torch.no_grad():
+        id_features = graph.encode(image)
+
+        # TorchScript module with forward(image, latent), encode(image) and decode(id_features, latent)
+        traced = torch.jit.trace_module(graph, {'forward': (image, latent), 'encode': image,
+                                                'decode': (id_features, latent)}, check_trace=False)
+        traced.save(os.path.join(out_dir, 'generator.pt'))
+
+        # ONNX graphs of the identity encoder and the decoder, the number of frames is dynamic
+        torch.onnx.export(graph.id_encoder, image, os.path.join(out_dir, onnx_backend.ENCODER_FILE),
+                          input_names=['image'], output_names=['id_features'],
+                          dynamic_axes={'image': {0: 'batch'}, 'id_features': {0: 'batch'}},
+                          opset_version=opt.onnx_opset, **export_kwargs)
+        torch.onnx.export(DecoderGraph(graph), (id_features, latent), os.path.join(out_dir, onnx_backend.DECODER_FILE),
+                          input_names=['id_features', 'latent'], output_names=['frames'],
+                          dynamic_axes={'latent': {0: 'frames'}, 'frames': {0: 'frames'}},
+                          opset_version=opt.onnx_opset, **export_kwargs)
+
+    print('exported generator.pt, %s and %s to %s' % (onnx_backend.ENCODER_FILE, onnx_backend.DECODER_FILE, out_dir))
+
+
+def timed(fn):
+    start = time.time()
+    out = fn()
+    return out, (time.time() - start) * 1000
+
+
+def eager_reference(opt, model):
+    # renders a traversal of a random image with the eager generator and its own modulated conv
+    # implementation (--modconv_impl). called before export, so the reference cannot be affected by it
+    torch.manual_seed(0)
+    image = torch.rand(1, opt.input_nc, opt.fineSize, opt.fineSize, device=model.device) * 2 - 1
+    with torch.no_grad():
+        keyframes = model.class_latents()
+        latent = networks.interpolate_latents(keyframes, *networks.traversal_schedule(keyframes.shape[0], opt.interp_step))
+        eager, eager_time = timed(lambda: model.netG.infer(image, None, deploy=True, target_latent=latent))
+    return image, latent, eager, eager_time
+
+
+def check_parity(opt, model, out_dir, reference):
+    # renders the traversal of the eager reference with the TorchScript module and the ONNX Runtime
+    # backend and reports the output differences in [-1, 1] and in uint8 pixel values
+    image, latent, eager, eager_time = reference
+    with torch.no_grad():
+        scripted = torch.jit.load(os.path.join(out_dir, 'generator.pt'), map_location=model.device)
+        outputs = [('torchscript',) + timed(lambda: scripted(image, latent))]
+
+    onnx_net = onnx_backend.OnnxGenerator(out_dir, model.netG, threads=opt.onnx_threads)
+    outputs.append(('onnx',) + timed(lambda: onnx_net.infer(image, None, target_latent=latent)))
+
+    eager_im = util.tensor2im(eager.cpu()).astype(np.int32)
+    print('%12s %10s %12s %14s' % ('backend', 'time(ms)', 'max diff', 'max uint8 diff'))
+    print('%12s %10.1f %12s %14s' % ('eager', eager_time, '-', '-'))
+    for name, out, elapsed in outputs:
+        out = out.to(eager.device)
+        max_diff = (out - eager).abs().max().item()
+        max_uint8_diff = np.abs(util.tensor2im(out.cpu()).astype(np.int32) - eager_im).max()
+        print('%12s %10.1f %12.2e %14d' % (name, elapsed, max_diff, max_uint8_diff))
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse(save=False)
+    opt.nThreads = 1
+    opt.batchSize = 1
+    opt.serial_batches = True
+    opt.no_flip = True
+    # the graphs are traced from the eager generator of this process
+    opt.backend = 'eager'
+    opt.cpu_workers = 0
+
+    # the dataset sets opt.numClasses, which the model is built with
+    data_loader = CreateDataLoader(opt)
+    model = create_model(opt)
+    model.eval()
+
+    out_dir = onnx_backend.export_dir(opt)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    reference = eager_reference(opt, model) if opt.check_parity else None
+    export(opt, model, out_dir)
+    if opt.check_parity:
+        check_parity(opt, model, out_dir, reference)
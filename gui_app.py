@@ -71,6 +71,10 @@ class PortraitApp:
         self.dataset = None
         self.visualizer = None
         self.opt = None
+
+        # 同じ写真を再生成するときにエンコーダを省略するための識別特徴キャッシュ
+        # （モデルはジョブごとに破棄されるのでGUI側で保持する）
+        self.id_cache = util.IdentityFeatureCache(max_entries=16)
         
         # 既存動画のリストを読み込む
         self.load_existing_videos()
@@ -163,7 +167,6 @@ class PortraitApp:
         # モデルの初期化
         self.opt = TestOptions().parse(save=False)
         self.opt.display_id = 0
-        self.opt.gpu_ids = [0]
         self.opt.nThreads = 1
         self.opt.batchSize = 1
         self.opt.serial_batches = True
@@ -203,6 +206,7 @@ class PortraitApp:
         
         self.model = create_model(self.opt)
         self.model.eval()
+        self.model.set_identity_cache(self.id_cache)
         
         print(f"使用中のモデル: {self.opt.name}")
         print(f"checkpoints/{self.opt.name} からモデルをロードしました")
@@ -217,6 +221,9 @@ class PortraitApp:
         """モデルとリソースを明示的に解放"""
         try:
             if self.model is not None:
+                # CPUワーカープロセスを使っている場合は終了させる
+                if hasattr(self.model, 'frame_net') and hasattr(self.model.frame_net, 'close'):
+                    self.model.frame_net.close()
                 # モデルをCPUに移動してからメモリ解放
                 if hasattr(self.model, 'netG'):
                     if hasattr(self.model.netG, 'cpu'):
@@ -895,21 +902,59 @@ class PortraitApp:
             data = self.dataset.dataset.get_item_from_path(image_path)
             self.progress['value'] = 50
             
-            # 推論実行
-            with torch.no_grad():  # 勾配計算を無効化してメモリ節約
-                visuals = self.model.inference(data)
-            
-            self.progress['value'] = 70
-            
-            # 出力処理
+            # 出力形式ごとに必要な出力
+            needs_video = output_format in ["動画のみ", "動画+画像フレーム", "動画+画像まとめ", "すべて"]
+            needs_frames = output_format in ["画像フレームのみ", "動画+画像フレーム", "すべて"]
+            needs_row = output_format in ["画像まとめのみ", "動画+画像まとめ", "すべて"]
+            needs_paper = output_format in ["論文用画像", "動画+論文用画像", "すべて"]
+            needs_paper_gen = output_format in ["論文用画像（生成のみ）", "すべて"]
+
             os.makedirs('Images/out', exist_ok=True)
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             generated_files = []
-            
+            video_path = os.path.join('Images/out', f'output_{timestamp}.mp4') if needs_video else None
+            frame_dir = os.path.join('Images/out', f'frames_{timestamp}') if needs_frames else None
+
+            # 論文用画像だけが必要な場合は、その画像に使うフレームだけをデコードする
+            needs_all_frames = needs_video or needs_frames or needs_row
+            frame_indices = None if needs_all_frames else self.visualizer.paper_frame_indices
+
+            # 体験ウィンドウが開いている場合は、キーフレーム→中間フレームの順（粗→細）に生成して
+            # 早い段階から粗い年齢変化を再生できるようにする
+            preview = needs_video and frame_indices is None and bool(self.experience_instances)
+
+            # 推論実行（デコードされたフレームから順に動画・画像フレームへ書き出す）
+            visual, frames = self.model.inference_stream(data, frame_indices=frame_indices, progressive=preview)
+            if frames is None:
+                raise RuntimeError("入力画像から顔を処理できませんでした")
+            frames = util.BackgroundGenerator(frames)
+
+            # 体験ウィンドウが開いている場合は生成中のフレームをそのまま流し込む。
+            # 画像フレームは届いた順にトラバーサル上の番号で書き出し、動画は前のフレームがそろった分から書き出す
+            callbacks = []
+            frame_order = None
+            if preview:
+                experience_instance = self.experience_instances[0]
+                experience_instance.start_frames(self.model.num_frames, self.model.frame_order)
+                callbacks = [experience_instance.append_frames]
+                frame_order = self.model.frame_order
+
+            keep_frames = needs_row or needs_paper or needs_paper_gen
+            try:
+                kept_frames = self.visualizer.write_stream(frames, video_path=video_path,
+                                                           frame_dir=frame_dir, orig_img=visual['orig_img'],
+                                                           keep_frames=keep_frames, callbacks=callbacks,
+                                                           frame_order=frame_order)
+            finally:
+                # 書き出しが途中で失敗してもデコードスレッドを止め、推論の途中状態を解放する
+                frames.close()
+            visuals = self.visualizer.frames_to_visuals(visual, kept_frames, self.model.frame_indices,
+                                                       self.model.num_frames) if keep_frames else None
+
+            self.progress['value'] = 70
+
             # 動画生成
-            if output_format in ["動画のみ", "動画+画像フレーム", "動画+画像まとめ", "すべて"]:
-                video_path = os.path.join('Images/out', f'output_{timestamp}.mp4')
-                self.visualizer.make_video(visuals, video_path)
+            if needs_video:
                 generated_files.append(("動画", video_path))
                 
                 # 生成済みファイルリストに追加
@@ -918,9 +963,7 @@ class PortraitApp:
                 self.video_listbox.insert(tk.END, f"[動画] {os.path.basename(video_path)}")
             
             # 画像フレーム生成
-            if output_format in ["画像フレームのみ", "動画+画像フレーム", "すべて"]:
-                frame_dir = os.path.join('Images/out', f'frames_{timestamp}')
-                self.visualizer.save_frame_images(visuals, frame_dir)
+            if needs_frames:
                 generated_files.append(("画像フレーム", frame_dir))
                 
                 # 生成済みファイルリストに追加
@@ -928,7 +971,7 @@ class PortraitApp:
                 self.video_listbox.insert(tk.END, f"[画像フレーム] frames_{timestamp}")
             
             # 画像まとめ生成
-            if output_format in ["画像まとめのみ", "動画+画像まとめ", "すべて"]:
+            if needs_row:
                 image_path_output = os.path.join('Images/out', f'combined_{timestamp}.png')
                 self.visualizer.save_row_image(visuals, image_path_output, traverse=True)
                 generated_files.append(("画像まとめ", image_path_output))
@@ -938,14 +981,15 @@ class PortraitApp:
                 self.video_listbox.insert(tk.END, f"[画像まとめ] {os.path.basename(image_path_output)}")
             
             # 論文用画像生成（オリジナル画像あり）
-            if output_format in ["論文用画像", "動画+論文用画像", "すべて"]:
+            if needs_paper:
                 # 論文用画像でのオリジナル背景保持モードの場合は、ファイル名を変更
                 paper_original = self.paper_original_var.get()
                 if paper_original == "オリジナル背景保持":
                     paper_path_output = os.path.join('Images/out', f'paper_orig_{timestamp}.png')
                 else:
                     paper_path_output = os.path.join('Images/out', f'paper_{timestamp}.png')
-                self.visualizer.save_paper_image(visuals, paper_path_output, include_original=True)
+                self.visualizer.save_paper_image(visuals, paper_path_output, include_original=True,
+                                                 num_frames=self.model.num_frames)
                 generated_files.append(("論文用画像", paper_path_output))
                 
                 # 生成済みファイルリストに追加
@@ -953,9 +997,10 @@ class PortraitApp:
                 self.video_listbox.insert(tk.END, f"[論文用画像] {os.path.basename(paper_path_output)}")
             
             # 論文用画像生成（生成画像のみ）
-            if output_format in ["論文用画像（生成のみ）", "すべて"]:
+            if needs_paper_gen:
                 paper_gen_path_output = os.path.join('Images/out', f'paper_gen_{timestamp}.png')
-                self.visualizer.save_paper_image(visuals, paper_gen_path_output, include_original=False)
+                self.visualizer.save_paper_image(visuals, paper_gen_path_output, include_original=False,
+                                                 num_frames=self.model.num_frames)
                 generated_files.append(("論文用画像（生成のみ）", paper_gen_path_output))
                 
                 # 生成済みファイルリストに追加
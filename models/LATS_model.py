@@ -4,11 +4,15 @@ import numpy as np
 import torch
 import torch.nn as nn
 import re
+import bisect
 import functools
 from collections import OrderedDict
 from .base_model import BaseModel
 import util.util as util
 from . import networks
+from . import onnx_backend
+from . import quantization
+from . import cpu_executor
 from pdb import set_trace as st
 from torch.autograd import Variable
 
@@ -33,6 +37,20 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
             self.trained_class_jump = opt.trained_class_jump
 
         self.deploy = (not self.isTrain) and opt.deploy
+        # inference precision (fp32, fp16 or bf16), see networks.autocast
+        self.precision = 'fp32' if self.isTrain else opt.precision
+        if self.precision == 'fp16' and self.device.type == 'cpu':
+            print('fp16 is not supported on cpu, using bf16 instead')
+            self.precision = 'bf16'
+
+        if self.traverse or self.deploy:
+            self.decode_chunk = opt.decode_chunk
+            self.decode_memory = opt.decode_memory_mb * 1024 * 1024
+        if self.traverse:
+            self.traverse_classes = opt.traverse_classes
+            self.segment_frames = opt.segment_frames
+            self.interp_easing = opt.interp_easing
+            self.adaptive_frames = opt.adaptive_frames if opt.segment_frames is None else 0
         if not self.isTrain and opt.random_seed != -1:
             torch.manual_seed(opt.random_seed)
             torch.cuda.manual_seed_all(opt.random_seed)
@@ -62,19 +80,17 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
 
         ##### define networks
         # Generators
-        self.netG = self.parallelize(networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.n_downsample,
-                                     id_enc_norm=opt.id_enc_norm, gpu_ids=self.gpu_ids, padding_type='reflect', style_dim=style_dim,
+        # the define_G arguments are kept so that worker processes can build the same generator (see cpu_executor)
+        self.generator_kwargs = dict(input_nc=opt.input_nc, output_nc=opt.output_nc, ngf=opt.ngf, n_downsample_global=opt.n_downsample,
+                                     id_enc_norm=opt.id_enc_norm, padding_type='reflect', style_dim=style_dim,
                                      init_type='kaiming', conv_weight_norm=opt.conv_weight_norm,
                                      decoder_norm=opt.decoder_norm, activation=opt.activation,
                                      adaptive_blocks=opt.n_adaptive_blocks, normalize_mlp=opt.normalize_mlp,
-                                     modulated_conv=opt.use_modulated_conv))
+                                     modulated_conv=opt.use_modulated_conv)
+        self.netG = self.parallelize(networks.define_G(gpu_ids=self.gpu_ids, inference_only=not self.isTrain,
+                                                       **self.generator_kwargs))
         if self.isTrain and self.use_moving_avg:
-            self.g_running = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, opt.n_downsample,
-                                               id_enc_norm=opt.id_enc_norm, gpu_ids=self.gpu_ids, padding_type='reflect', style_dim=style_dim,
-                                               init_type='kaiming', conv_weight_norm=opt.conv_weight_norm,
-                                               decoder_norm=opt.decoder_norm, activation=opt.activation,
-                                               adaptive_blocks=opt.n_adaptive_blocks, normalize_mlp=opt.normalize_mlp,
-                                               modulated_conv=opt.use_modulated_conv)
+            self.g_running = networks.define_G(gpu_ids=self.gpu_ids, **self.generator_kwargs)
             self.g_running.train(False)
             self.requires_grad(self.g_running, flag=False)
             self.accumulate(self.g_running, self.netG, decay=0)
@@ -101,6 +117,53 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
             else:
                 self.load_network(self.netG, 'G', opt.which_epoch, pretrained_path)
 
+        if not self.isTrain:
+            if not opt.no_freeze:
+                networks.freeze_for_inference(self.netG)
+            networks.set_modulated_conv_impl(self.netG, opt.modconv_impl)
+            # the weights are fixed from here on, so the per layer styles of a latent batch
+            # (e.g. the frames of a traversal schedule) can be projected once and reused
+            self.netG.decoder.enable_style_cache()
+            quantize_parts = quantization.parse_parts(opt.quantize)
+            if quantize_parts and self.device.type != 'cpu':
+                print('int8 quantization is only supported on cpu, running in float')
+            elif quantize_parts:
+                quantization.quantize_generator(self.netG, quantize_parts, onnx_backend.export_dir(opt))
+
+        if not self.isTrain and opt.id_cache_size > 0:
+            self.set_identity_cache(util.IdentityFeatureCache(opt.id_cache_size, opt.id_cache_dir))
+
+        # frames of render_age, keyed by identity and quantized age
+        if not self.isTrain:
+            # output and host staging buffers reused across inference requests of the same shape
+            self.arena = util.BufferArena()
+            self.age_step = opt.age_step
+            self.age_cache_size = opt.age_cache_size
+            self.age_frames = OrderedDict()
+
+        # traverse/deploy frames are rendered by frame_net, the eager generator, its exported graph
+        # or a pool of cpu worker processes
+        frame_net = self.netG
+        if not self.isTrain and opt.backend == 'onnx':
+            frame_net = onnx_backend.OnnxGenerator(onnx_backend.export_dir(opt), self.netG, threads=opt.onnx_threads)
+        elif not self.isTrain and opt.cpu_workers > 1:
+            if self.device.type != 'cpu' or quantize_parts:
+                print('cpu workers are only supported for float inference on cpu, running in a single process')
+            else:
+                frame_net = cpu_executor.ShardedGenerator(self.netG, self.generator_kwargs, opt.cpu_workers,
+                                                          precision=self.precision, impl=opt.modconv_impl)
+        # set without nn.Module registration: netG is already a submodule (frame_net would duplicate its
+        # state dict keys) and the other backends are not modules, which nn.Module would refuse to assign
+        object.__setattr__(self, 'frame_net', frame_net)
+
+        # without condition noise the mapping network always sees the same per class inputs,
+        # so its outputs (W) are computed once here and looked up at inference time
+        if not self.isTrain and self.no_cond_noise:
+            with torch.no_grad():
+                self.style_table = self.netG.map_styles(self.make_conditions(torch.arange(self.numClasses)))
+        else:
+            self.style_table = None
+
 
         # set loss functions and optimizers
         if self.isTrain:
@@ -171,18 +234,18 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
         input_dict = data
         if mode == 'train':
             # training mode
-            self.reals = Variable(input_dict['A']).cuda()
-            self.reals_B = Variable(input_dict['B']).cuda()
-            self.class_A = input_dict['A_class'].cuda()
-            self.class_B = input_dict['B_class'].cuda()
+            self.reals = Variable(input_dict['A']).to(self.device)
+            self.reals_B = Variable(input_dict['B']).to(self.device)
+            self.class_A = input_dict['A_class'].to(self.device)
+            self.class_B = input_dict['B_class'].to(self.device)
             self.paths = input_dict['A_paths']
             self.numValid = self.reals.size(0)
             self.isEmpty = self.numValid == 0
         else:
             # inference mode
-            self.reals = Variable(input_dict['Imgs']).cuda()
+            self.reals = Variable(input_dict['Imgs']).to(self.device)
             self.paths = input_dict['Paths']
-            self.class_A = Variable(input_dict['Classes']).cuda()
+            self.class_A = Variable(input_dict['Classes']).to(self.device)
             self.valid = input_dict['Valid']
             
             # self.validがboolの場合はtensorに変換
@@ -195,7 +258,9 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
             
             # 論文用画像でオリジナル背景保持の場合の画像を保存
             if 'Original_Img_For_Paper' in input_dict:
-                self.original_for_paper = [input_dict['Original_Img_For_Paper']]
+                self.original_for_paper = input_dict['Original_Img_For_Paper']
+                if not isinstance(self.original_for_paper, list):
+                    self.original_for_paper = [self.original_for_paper]
             else:
                 self.original_for_paper = None
 
@@ -206,7 +271,7 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
                 self.reals = self.reals.unsqueeze(0)
 
             if type(self.class_A) == list:
-                self.class_A = self.class_A[0].cuda()
+                self.class_A = self.class_A[0].to(self.device)
 
             self.numValid = self.valid.sum().item()
 
@@ -219,12 +284,29 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
             for i in range(self.reals.size(0)):
                 if self.valid[i]:
                     reals_list += [self.reals[i:i+1, :, :, :]]
-                    class_A_list += [self.class_A]
+                    class_A_list += [self.class_A.view(-1)[i:i+1]]
 
             self.reals = torch.cat(reals_list, 0)
             self.class_A = torch.cat(class_A_list, 0).squeeze()
 
 
+    def make_conditions(self, classes, noise_sigma=0):
+        # build the conditions for a tensor of class indices in one batched operation:
+        # a single gaussian noise draw, then a scatter of the one-hot class blocks.
+        # returns a tensor of shape classes.shape + (cond_length,)
+        classes = classes.long().to(self.device)
+        size = tuple(classes.shape) + (self.cond_length,)
+        if noise_sigma > 0:
+            # noise is drawn on the CPU generator so seeded runs match across devices
+            conditions = (noise_sigma * torch.randn(size)).to(self.device)
+        else:
+            conditions = torch.zeros(size, device=self.device)
+
+        index = classes.unsqueeze(-1) * self.duplicate + torch.arange(self.duplicate, device=self.device)
+        conditions.scatter_add_(-1, index, torch.ones(index.shape, device=self.device))
+        return conditions
+
+
     def get_conditions(self, mode='train'):
         # set conditional inputs to the network
         if mode == 'train':
@@ -237,29 +319,19 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
         else:
             nb = self.numValid
 
-        #tex condition mapping
-        condG_A_gen = self.Tensor(nb, self.cond_length)
-        condG_B_gen = self.Tensor(nb, self.cond_length)
-        condG_A_orig = self.Tensor(nb, self.cond_length)
-        condG_B_orig = self.Tensor(nb, self.cond_length)
-
         if self.no_cond_noise:
             noise_sigma = 0
         else:
             noise_sigma = 0.2
 
-        for i in range(nb):
-            condG_A_gen[i, :] = (noise_sigma * torch.randn(1, self.cond_length)).cuda()
-            condG_A_gen[i, self.class_B[i]*self.duplicate:(self.class_B[i] + 1)*self.duplicate] += 1
-            if not (self.traverse or self.deploy):
-                condG_B_gen[i, :] = (noise_sigma * torch.randn(1, self.cond_length)).cuda()
-                condG_B_gen[i, self.class_A[i]*self.duplicate:(self.class_A[i] + 1)*self.duplicate] += 1
-
-                condG_A_orig[i, :] = (noise_sigma * torch.randn(1, self.cond_length)).cuda()
-                condG_A_orig[i, self.class_A[i]*self.duplicate:(self.class_A[i] + 1)*self.duplicate] += 1
-
-                condG_B_orig[i, :] = (noise_sigma * torch.randn(1, self.cond_length)).cuda()
-                condG_B_orig[i, self.class_B[i]*self.duplicate:(self.class_B[i] + 1)*self.duplicate] += 1
+        #tex condition mapping
+        class_B = self.class_B.view(-1)[:nb].long().to(self.device)
+        if self.traverse or self.deploy:
+            condG_A_gen = self.make_conditions(class_B.unsqueeze(0), noise_sigma)[0]
+        else:
+            class_A = self.class_A.view(-1)[:nb].long().to(self.device)
+            classes = torch.stack((class_B, class_A, class_A, class_B), 0)
+            condG_A_gen, condG_B_gen, condG_A_orig, condG_B_orig = self.make_conditions(classes, noise_sigma)
 
         if mode == 'train':
             self.gen_conditions =  torch.cat((condG_A_gen, condG_B_gen), 0) #torch.cat((self.class_B, self.class_A), 0)
@@ -291,13 +363,13 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
         if self.opt.lambda_rec > 0:
             loss_G_Rec = self.criterionRec(rec_images, self.reals) * self.opt.lambda_rec
         else:
-            loss_G_Rec = torch.zeros(1).cuda()
+            loss_G_Rec = torch.zeros(1, device=self.device)
 
         #cycle loss
         if self.opt.lambda_cyc > 0:
             loss_G_Cycle = self.criterionCycle(cyc_images, self.reals) * self.opt.lambda_cyc
         else:
-            loss_G_Cycle = torch.zeros(1).cuda()
+            loss_G_Cycle = torch.zeros(1, device=self.device)
 
         # identity feature loss
         loss_G_identity_reconst = self.identity_reconst_criterion(fake_id_features, orig_id_features) * self.opt.lambda_id
@@ -393,44 +465,249 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
         return {'loss_D_real': loss_D_real.mean(), 'loss_D_fake': loss_D_fake.mean(), 'loss_D_reg': loss_D_reg.mean()}
 
 
+    def set_identity_cache(self, cache):
+        # attaches a util.IdentityFeatureCache to the generator. entries are keyed by the model
+        # (name, epoch and quantization), so one cache can be shared by several models
+        self.netG.id_cache = cache
+        self.netG.id_cache_name = '%s_%s_%s' % (self.opt.name, self.opt.which_epoch, self.opt.quantize)
+
+
+    def class_latents(self):
+        # W of every age class without condition noise
+        if self.style_table is not None:
+            return self.style_table
+        with torch.no_grad():
+            return self.netG.map_styles(self.make_conditions(torch.arange(self.numClasses)))
+
+
+    def class_ages(self):
+        # representative age of every class: the center of its sort_order age range, e.g. 30-39 -> 34.5
+        ages = []
+        for class_name in self.opt.sort_order:
+            bounds = [int(s) for s in re.split('-|_', class_name) if s.isdigit()]
+            ages += [(bounds[0] + bounds[-1]) / 2.0]
+        return ages
+
+
+    def age_latent(self, age):
+        # W of a continuous age, interpolated between the W of the two classes whose centers enclose it.
+        # ages outside the class centers are clamped to the first/last class
+        ages = self.class_ages()
+        latents = self.class_latents()
+        if age <= ages[0]:
+            return latents[:1]
+        if age >= ages[-1]:
+            return latents[-1:]
+        i = bisect.bisect_right(ages, age) - 1
+        alpha = (ages[i + 1] - age) / (ages[i + 1] - ages[i])
+        return alpha * latents[i:i + 1] + (1 - alpha) * latents[i + 1:i + 2]
+
+
+    def render_age(self, identity, age):
+        # renders a single frame of identity (a preprocessed image, 1 x C x H x W, or the dict of
+        # get_item_from_path) at a continuous age in years. the age is rounded to a multiple of age_step
+        # and the frames are kept in an LRU cache keyed by identity and rounded age. attach an identity
+        # cache (set_identity_cache) to also skip the identity encoder on cache misses.
+        # returns a uint8 array of shape (H, W, 3)
+        if isinstance(identity, dict):
+            identity = identity['Imgs']
+        if identity.dim() == 3:
+            identity = identity.unsqueeze(0)
+        step = int(round(age / self.age_step))
+        key = (util.tensor_key(identity, self.opt.name), step)
+        if key in self.age_frames:
+            self.age_frames.move_to_end(key)
+            return self.age_frames[key]
+
+        with torch.no_grad(), self.autocast():
+            latent = self.age_latent(step * self.age_step)
+            out = self.frame_net.infer(identity.to(self.device), None, deploy=True, target_latent=latent)
+        frame = self.to_images(out.data, 'age_frame')[:, :, :3]
+
+        if self.age_cache_size > 0:
+            self.age_frames[key] = frame
+            while len(self.age_frames) > self.age_cache_size:
+                self.age_frames.popitem(last=False)
+        return frame
+
+
+    def get_traversal_schedule(self, num_keyframes, target_latent=None):
+        # frame layout of a traversal through num_keyframes age classes. with adaptive_frames, the frames
+        # of the traversal are distributed over the segments by how much the face changes in each of them
+        segment_frames = self.segment_frames
+        if self.adaptive_frames > 0 and target_latent is not None and num_keyframes > 1:
+            segment_frames = networks.allocate_frames(self.keyframe_deltas(target_latent), self.adaptive_frames)
+        return networks.traversal_schedule(num_keyframes, self.opt.interp_step,
+                                           segment_frames=segment_frames, easing=self.interp_easing)
+
+
+    def keyframe_deltas(self, target_latent):
+        # mean absolute pixel difference between neighbouring keyframes of the current inputs.
+        # decodes one frame per keyframe and averages over the images
+        num_images, num_keyframes = self.reals.shape[0], target_latent.shape[0]
+        with torch.no_grad(), self.autocast():
+            frames = self.decode_frames(self.reals, target_latent, 'keyframes')
+        frames = frames.float().view((num_images, num_keyframes, -1))
+        return (frames[:, 1:] - frames[:, :-1]).abs().mean(2).mean(0).tolist()
+
+
+    def get_target_latents(self):
+        # per class W vectors of a traverse/deploy request and, in traverse mode, its frame schedule
+        if self.traverse and self.compare_to_trained_outputs:
+            start = self.compare_to_trained_class - self.trained_class_jump
+            end = start + (self.trained_class_jump * 2) * 2 #arange is between [start, end), end is always omitted
+            self.class_B = torch.arange(start, end, step=self.trained_class_jump*2, dtype=self.class_A.dtype)
+        elif self.traverse and self.traverse_classes is not None:
+            self.class_B = torch.tensor(self.traverse_classes, dtype=self.class_A.dtype)
+        else:
+            self.class_B = torch.arange(self.numClasses, dtype=self.class_A.dtype)
+
+        if self.style_table is not None:
+            self.gen_conditions = None
+            target_latent = self.style_table[self.class_B.long().to(self.device)]
+        else:
+            self.get_conditions(mode='test')
+            target_latent = self.netG.map_styles(self.gen_conditions)
+
+        if self.traverse:
+            schedule = self.get_traversal_schedule(len(self.class_B), target_latent)
+        else:
+            schedule = None
+
+        return target_latent, schedule
+
+
+    def inference_stream(self, data, chunk_size=8, frame_indices=None, progressive=False):
+        # traverse/deploy inference that decodes the frames chunk by chunk instead of all at once.
+        # returns the visuals dict of the input image and a generator that yields the frames as uint8
+        # arrays of shape (n, H, W, 3) while they are decoded. self.num_frames holds the number of frames.
+        # frame_indices restricts decoding to a subset of the frames: a list of frame indices or a function
+        # that maps the number of frames to such a list. the rendered indices are kept in self.frame_indices.
+        # with progressive, the frames are decoded coarse to fine (see networks.progressive_order) and
+        # self.frame_order holds the traversal index of every yielded frame, self.frame_passes the passes
+        self.set_inputs(data, mode='test')
+        if self.isEmpty:
+            return None, None
+
+        with torch.no_grad():
+            target_latent, schedule = self.get_target_latents()
+            if schedule is not None:
+                target_latent = networks.interpolate_latents(target_latent, *schedule)
+
+        self.num_frames = target_latent.shape[0]
+        self.frame_indices = None
+        self.frame_order = None
+        self.frame_passes = None
+        if frame_indices is not None:
+            if callable(frame_indices):
+                frame_indices = frame_indices(self.num_frames)
+            self.frame_indices = sorted(set(frame_indices))
+            target_latent = target_latent[torch.tensor(self.frame_indices, device=target_latent.device)]
+        elif progressive:
+            keyframes = networks.keyframe_indices(schedule[1]) if schedule is not None else range(self.num_frames)
+            self.frame_passes = networks.progressive_order(self.num_frames, keyframes)
+            self.frame_order = [i for frame_pass in self.frame_passes for i in frame_pass]
+            target_latent = target_latent[torch.tensor(self.frame_order, device=target_latent.device)]
+
+        visual = OrderedDict([('orig_img', util.tensor2im(self.reals[0:1].data)[:, :, :3])])
+        if self.original_for_paper is not None:
+            visual['paper_orig_img'] = self.original_for_paper[0]
+
+        return visual, self.iter_frames(self.reals, target_latent, self.decode_chunk or chunk_size)
+
+
+    def autocast(self):
+        # reduced precision region of inference, a no-op for fp32
+        return networks.autocast(self.device.type, self.precision)
+
+
+    def to_images(self, tensor, name):
+        # uint8 channels last images of an output tensor, converted on its device (see util.tensor2uint8)
+        # and copied to the host through the pinned arena buffer name. the result does not share the buffer
+        images = util.tensor2uint8(tensor)
+        if images.is_cuda:
+            return self.arena.to_host(images, name).numpy().copy()
+        return images.numpy()
+
+
+    def inference_batch(self, data):
+        # traverse/deploy inference of several images (see get_items_from_paths). all (image, frame) pairs
+        # are decoded in chunks bounded by decode_chunk and decode_memory_mb. returns one visuals dict per
+        # valid image, in the format of inference. the images share the target latents (and condition noise)
+        self.set_inputs(data, mode='test')
+        if self.isEmpty:
+            return []
+
+        with torch.no_grad(), self.autocast():
+            target_latent, schedule = self.get_target_latents()
+            if schedule is not None:
+                target_latent = networks.interpolate_latents(target_latent, *schedule)
+
+            num_frames = target_latent.shape[0]
+            frames = self.decode_frames(self.reals, target_latent)
+            self.fake_B = frames.view((self.numValid, num_frames) + frames.shape[1:])
+
+            return self.get_visuals()
+
+
+    def decode_frames(self, reals, target_latent, name='fake_B'):
+        # decodes every image of reals with all per frame latents in chunks bounded by decode_chunk and
+        # decode_memory_mb, into the arena buffer name. returns (images * frames) x C x H x W, image major
+        num_frames = target_latent.shape[0]
+        frames = None
+        for start, out in self.frame_net.iter_infer(reals, target_latent, chunk_size=self.decode_chunk,
+                                                    memory_budget=self.decode_memory):
+            if frames is None:
+                frames = self.arena.get(name, (reals.shape[0] * num_frames,) + out.shape[1:], out.dtype, out.device)
+            frames[start:start + out.shape[0]] = out
+        return frames
+
+
+    def iter_frames(self, reals, latent, chunk_size):
+        if isinstance(self.frame_net, cpu_executor.ShardedGenerator):
+            # the workers convert their frames to uint8 themselves
+            with torch.no_grad(), self.autocast():
+                for _, frames in self.frame_net.iter_images(reals, latent, chunk_size=chunk_size, memory_budget=self.decode_memory):
+                    yield frames.numpy()[:, :, :, :3]
+            return
+        with torch.no_grad(), self.autocast():
+            for _, frames in self.frame_net.iter_infer(reals, latent, chunk_size=chunk_size, memory_budget=self.decode_memory):
+                frames = self.to_images(frames.data, 'frames')
+                if frames.ndim == 3:
+                    frames = np.expand_dims(frames, axis=0)
+                yield frames[:, :, :, :3]
+
+
     def inference(self, data):
         self.set_inputs(data, mode='test')
         if self.isEmpty:
             return
 
         self.numValid = self.valid.sum().item()
-        sz = self.reals.size()
-        self.fake_B = self.Tensor(self.numClasses, sz[0], sz[1], sz[2], sz[3])
-        self.cyc_A = self.Tensor(self.numClasses, sz[0], sz[1], sz[2], sz[3])
 
-        with torch.no_grad():
+        with torch.no_grad(), self.autocast():
             if self.traverse or self.deploy:
-                if self.traverse and self.compare_to_trained_outputs:
-                    start = self.compare_to_trained_class - self.trained_class_jump
-                    end = start + (self.trained_class_jump * 2) * 2 #arange is between [start, end), end is always omitted
-                    self.class_B = torch.arange(start, end, step=self.trained_class_jump*2, dtype=self.class_A.dtype)
-                else:
-                    self.class_B = torch.arange(self.numClasses, dtype=self.class_A.dtype)
-
-                self.get_conditions(mode='test')
-
-                self.fake_B = self.netG.infer(self.reals, self.gen_conditions, traverse=self.traverse, deploy=self.deploy, interp_step=self.opt.interp_step)
+                # the frames are decoded into a reused buffer, no cycle reconstructions are computed
+                target_latent, schedule = self.get_target_latents()
+                if schedule is not None:
+                    target_latent = networks.interpolate_latents(target_latent, *schedule)
+                frames = self.decode_frames(self.reals, target_latent)
+                self.fake_B = frames.view((self.reals.shape[0], target_latent.shape[0]) + frames.shape[1:])
             else:
-                for i in range(self.numClasses):
-                    self.class_B = self.Tensor(self.numValid).long().fill_(i)
-                    self.get_conditions(mode='test')
-
-                    if self.isTrain:
-                        self.fake_B[i, :, :, :, :] = self.g_running.infer(self.reals, self.gen_conditions)
-                    else:
-                        self.fake_B[i, :, :, :, :] = self.netG.infer(self.reals, self.gen_conditions)
-
-                    cyc_input = self.fake_B[i, :, :, :, :]
-
-                    if self.isTrain:
-                        self.cyc_A[i, :, :, :, :] = self.g_running.infer(cyc_input, self.cyc_conditions)
-                    else:
-                        self.cyc_A[i, :, :, :, :] = self.netG.infer(cyc_input, self.cyc_conditions)
+                # translate every valid sample to all classes: encode the samples once and decode
+                # all (class, sample) pairs in one batch. fake_B is numClasses x numValid x C x H x W
+                netG = self.g_running if self.isTrain else self.netG
+                noise_sigma = 0 if self.no_cond_noise else 0.2
+                self.class_B = torch.arange(self.numClasses).view(-1, 1).repeat(1, self.numValid)
+                self.gen_conditions = self.make_conditions(self.class_B, noise_sigma)
+                self.fake_B = netG.infer_targets(self.reals, self.gen_conditions)
+
+                # the cycle reconstructions are only shown in debug mode
+                if self.debug_mode:
+                    class_A = self.class_A.view(1, -1)[:, :self.numValid].repeat(self.numClasses, 1)
+                    self.cyc_conditions = self.make_conditions(class_A, noise_sigma)
+                    cyc_input = self.fake_B.view((-1,) + self.fake_B.shape[2:])
+                    self.cyc_A = netG.infer(cyc_input, self.cyc_conditions.view(cyc_input.shape[0], -1)).view(self.fake_B.shape)
 
             visuals = self.get_visuals()
 
@@ -457,13 +734,16 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
 
 
     def get_visuals(self):
+        # traverse/deploy visuals are util.Visuals (the frames of an image in one uint8 array), test mode
+        # visuals are dicts with one entry per image
         return_dicts = [OrderedDict() for i in range(self.numValid)]
 
         real_A = util.tensor2im(self.reals.data)
-        fake_B_tex = util.tensor2im(self.fake_B.data)
+        # traverse/deploy outputs are numValid x frames x C x H x W
+        fake_B_tex = self.to_images(self.fake_B.data, 'fake_B')
 
-        if self.debug_mode:
-            rec_A_tex = util.tensor2im(self.cyc_A.data[:,:,:,:,:])
+        if self.debug_mode and not (self.traverse or self.deploy):
+            rec_A_tex = self.to_images(self.cyc_A.data, 'cyc_A')
 
         if self.numValid == 1:
             real_A = np.expand_dims(real_A, axis=0)
@@ -475,12 +755,17 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
 
             # start with age progression/regression images
             if self.traverse or self.deploy:
-                curr_fake_B_tex = fake_B_tex
-                orig_dict = OrderedDict([('orig_img', real_A_img)])
-            else:
-                curr_fake_B_tex = fake_B_tex[:, i, :, :, :]
-                orig_dict = OrderedDict([('orig_img_cls_' + str(self.class_A[i].item()), real_A_img)])
-
+                curr_fake_B_tex = fake_B_tex[i]
+                images = [('orig_img', real_A_img)]
+                # 論文用画像でオリジナル背景保持の場合の画像を追加
+                if self.original_for_paper is not None:
+                    images.append(('paper_orig_img', self.original_for_paper[i]))
+                out_classes = curr_fake_B_tex.shape[0] if self.traverse else self.numClasses
+                return_dicts[i] = util.Visuals(np.ascontiguousarray(curr_fake_B_tex[:out_classes, :, :, :3]), images)
+                continue
+
+            curr_fake_B_tex = fake_B_tex[:, i, :, :, :]
+            orig_dict = OrderedDict([('orig_img_cls_' + str(self.class_A[i].item()), real_A_img)])
             return_dicts[i].update(orig_dict)
 
             # 論文用画像でオリジナル背景保持の場合の画像を追加
@@ -488,27 +773,20 @@ class LATS(BaseModel): #Lifetime Age Transformation Synthesis
                 paper_orig_dict = OrderedDict([('paper_orig_img', self.original_for_paper[i])])
                 return_dicts[i].update(paper_orig_dict)
 
-            # set output classes numebr
-            if self.traverse:
-                out_classes = curr_fake_B_tex.shape[0]
-            else:
-                out_classes = self.numClasses
-
-            for j in range(out_classes):
+            for j in range(self.numClasses):
                 fake_res_tex = curr_fake_B_tex[j, :, :, :3]
                 fake_dict_tex = OrderedDict([('tex_trans_to_class_' + str(j), fake_res_tex)])
                 return_dicts[i].update(fake_dict_tex)
 
-            if not (self.traverse or self.deploy):
-                if self.debug_mode:
-                    # continue with tex reconstructions
-                    curr_rec_A_tex = rec_A_tex[:, i, :, :, :]
-                    orig_dict = OrderedDict([('orig_img2', real_A_img)])
-                    return_dicts[i].update(orig_dict)
-                    for j in range(self.numClasses):
-                        rec_res_tex = curr_rec_A_tex[j, :, :, :3]
-                        rec_dict_tex = OrderedDict([('tex_rec_from_class_' + str(j), rec_res_tex)])
-                        return_dicts[i].update(rec_dict_tex)
+            if self.debug_mode:
+                # continue with tex reconstructions
+                curr_rec_A_tex = rec_A_tex[:, i, :, :, :]
+                orig_dict = OrderedDict([('orig_img2', real_A_img)])
+                return_dicts[i].update(orig_dict)
+                for j in range(self.numClasses):
+                    rec_res_tex = curr_rec_A_tex[j, :, :, :3]
+                    rec_dict_tex = OrderedDict([('tex_rec_from_class_' + str(j), rec_res_tex)])
+                    return_dicts[i].update(rec_dict_tex)
 
         return return_dicts
 
@@ -4,6 +4,8 @@ import os
 import torch
 import torch.nn as nn
 import sys
+from . import networks
+from . import tensor_file
 
 class BaseModel(torch.nn.Module):
     def name(self):
@@ -13,7 +15,8 @@ class BaseModel(torch.nn.Module):
         self.opt = opt
         self.gpu_ids = opt.gpu_ids
         self.isTrain = opt.isTrain
-        self.Tensor = torch.cuda.FloatTensor if torch.cuda.is_available() else torch.Tensor
+        self.device = torch.device(opt.device)
+        self.Tensor = torch.cuda.FloatTensor if self.device.type == 'cuda' else torch.FloatTensor
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)
 
     def set_input(self, input):
@@ -56,18 +59,25 @@ class BaseModel(torch.nn.Module):
         if not save_dir:
             save_dir = self.save_dir
         save_path = os.path.join(save_dir, save_filename)
-        if not os.path.isfile(save_path):
+        # at test time a converted tensor file (see convert_checkpoint.py) is preferred over the pickled checkpoint
+        tensor_path = os.path.splitext(save_path)[0] + tensor_file.EXTENSION
+        if not self.isTrain and self.opt.load_format != 'pth' and os.path.isfile(tensor_path):
+            self.load_tensor_file(network, tensor_path)
+        elif not os.path.isfile(save_path):
             print('%s not exists yet!' % save_path)
             if 'G' in network_label:
                 raise('Generator must exist!')
+        elif networks.is_meta(network):
+            # inference only networks have no storage yet, the checkpoint tensors are assigned to them
+            self.assign_network(network, torch.load(save_path, map_location=self.device))
         else:
+            pretrained_dict = torch.load(save_path, map_location=self.device)
             try:
                 if isinstance(network,nn.DataParallel):
-                    network.module.load_state_dict(torch.load(save_path))
+                    network.module.load_state_dict(pretrained_dict)
                 else:
-                    network.load_state_dict(torch.load(save_path))
+                    network.load_state_dict(pretrained_dict)
             except:
-                pretrained_dict = torch.load(save_path)
                 if isinstance(network,nn.DataParallel):
                     model_dict = network.module.state_dict()
                 else:
@@ -95,5 +105,26 @@ class BaseModel(torch.nn.Module):
                         print(sorted(not_initialized))
                     network.load_state_dict(model_dict)
 
+    def load_tensor_file(self, network, path):
+        # memory mapped loading of a converted checkpoint. weights that were frozen by the converter are
+        # loaded into a frozen network, weights stored in reduced precision are converted back to fp32
+        state_dict, metadata = tensor_file.load(path, dtype=torch.float32)
+        if metadata.get('frozen') == 'true' and not getattr(network, 'frozen', False):
+            networks.freeze_for_inference(network)
+        if self.device.type != 'cpu':
+            state_dict = {k: v.to(self.device) for k, v in state_dict.items()}
+        if networks.is_meta(network):
+            self.assign_network(network, state_dict)
+        else:
+            model_keys = set(network.state_dict().keys())
+            network.load_state_dict({k: v for k, v in state_dict.items() if k in model_keys})
+
+    def assign_network(self, network, state_dict):
+        # loads the subset of state_dict that network uses, e.g. only the id_encoder and decoder
+        # weights of a full generator checkpoint, without copying the tensors
+        model_keys = set(network.state_dict().keys())
+        state_dict = {k: v for k, v in state_dict.items() if k in model_keys}
+        network.load_state_dict(state_dict, assign=True)
+
     def update_learning_rate():
         pass
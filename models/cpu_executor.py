@@ -0,0 +1,180 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import math
+import queue
+import atexit
+import shutil
+import tempfile
+import traceback
+import torch
+import torch.multiprocessing as mp
+from . import networks
+from . import tensor_file
+import util.util as util
+
+WEIGHTS_FILE = 'generator' + tensor_file.EXTENSION
+# number of frame shards per worker of a traversal, more shards deliver the first frames of a stream earlier
+SHARDS_PER_WORKER = 2
+
+
+def load_worker_generator(generator_kwargs, weights_path, impl):
+    # builds the inference only generator of a worker and maps the weights written by ShardedGenerator
+    netG = networks.define_G(inference_only=True, **generator_kwargs)
+    state_dict, metadata = tensor_file.load(weights_path)
+    if metadata.get('frozen') == 'true':
+        networks.freeze_for_inference(netG)
+    model_keys = set(netG.state_dict().keys())
+    state_dict = {k: v for k, v in state_dict.items() if k in model_keys}
+    if networks.is_meta(netG):
+        netG.load_state_dict(state_dict, assign=True)
+    else:
+        netG.load_state_dict(state_dict)
+    netG.eval()
+    networks.set_modulated_conv_impl(netG, impl)
+    netG.decoder.enable_style_cache()
+    return netG
+
+
+def worker_loop(generator_kwargs, weights_path, impl, precision, threads, tasks, results, current_job):
+    # decodes (job, index, id_features, latent, images) tasks until it receives None. the frames of a task
+    # are sent back as float C x H x W frames, or as uint8 H x W x C images when images is true.
+    # tasks of another job than current_job (an abandoned stream) are dropped without decoding them
+    torch.set_num_threads(threads)
+    try:
+        netG = load_worker_generator(generator_kwargs, weights_path, impl)
+    except Exception:
+        results.put((None, None, traceback.format_exc()))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job, index, id_features, latent, images = task
+        if job != current_job.value:
+            continue
+        try:
+            with torch.no_grad(), networks.autocast('cpu', precision):
+                out = netG.decode(id_features, None, deploy=True, target_latent=latent)
+            if images:
+                frames = util.tensor2uint8(out)
+                out = frames.view((out.shape[0],) + frames.shape[-3:])
+            results.put((job, index, out))
+        except Exception:
+            results.put((job, index, traceback.format_exc()))
+
+
+class ShardedGenerator(object):
+    # decodes traverse/deploy frames in a pool of cpu worker processes. the identity features are encoded once
+    # in this process and shared with the workers through shared memory, the frame latents are split into
+    # shards that the workers decode in parallel. every worker builds the generator itself and maps the
+    # weights from a tensor file, so the weights are shared through the page cache.
+    # implements the traverse/deploy part of the Generator interface (infer, iter_infer) and iter_images
+    def __init__(self, generator, generator_kwargs, num_workers, precision='fp32', impl='auto', threads=0):
+        self.generator = generator
+        self.num_workers = num_workers
+        self.job = 0
+
+        self.weights_dir = tempfile.mkdtemp(prefix='lats_workers_')
+        weights_path = os.path.join(self.weights_dir, WEIGHTS_FILE)
+        metadata = {'format': 'pt', 'frozen': 'true' if getattr(generator, 'frozen', False) else 'false'}
+        tensor_file.save(weights_path, generator.state_dict(), metadata)
+
+        if threads <= 0:
+            threads = max(torch.get_num_threads() // num_workers, 1)
+        # spawned workers do not inherit the threads (e.g. tkinter) of this process
+        context = mp.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        # the job whose tasks the workers decode (0 while no stream is running), tasks of other jobs are skipped
+        self.current_job = context.Value('i', 0)
+        self.workers = []
+        for _ in range(num_workers):
+            worker = context.Process(target=worker_loop, args=(generator_kwargs, weights_path, impl, precision,
+                                                                threads, self.tasks, self.results, self.current_job),
+                                    daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        atexit.register(self.close)
+
+    def chunk_frames(self, id_features, chunk_size=None, memory_budget=None):
+        return self.generator.decoder.chunk_frames(id_features, chunk_size, memory_budget)
+
+    def shards(self, num_images, num_frames, chunk_size=None):
+        # (image, start, end) frame ranges of a job, at most chunk_size frames each
+        shard_size = int(math.ceil(float(num_images * num_frames) / (self.num_workers * SHARDS_PER_WORKER)))
+        if chunk_size:
+            shard_size = min(shard_size, chunk_size)
+        shard_size = max(shard_size, 1)
+        return [(i, start, min(start + shard_size, num_frames))
+                for i in range(num_images) for start in range(0, num_frames, shard_size)]
+
+    def run(self, input, target_latent, chunk_size=None, memory_budget=None, images=False):
+        # yields (first frame index, frames) of every shard in frame order, frames are ordered image major
+        id_features = self.generator.encode_identity(input).detach().cpu().contiguous().share_memory_()
+        latent = target_latent.detach().cpu().contiguous().share_memory_()
+        num_frames = latent.shape[0]
+        chunk_size = self.chunk_frames(id_features, chunk_size, memory_budget)
+        shards = self.shards(id_features.shape[0], num_frames, chunk_size)
+
+        # tasks and results of an abandoned job (e.g. a stream that was not consumed to the end) are skipped
+        self.job += 1
+        job = self.job
+        self.current_job.value = job
+        for index, (i, start, end) in enumerate(shards):
+            self.tasks.put((job, index, id_features[i:i + 1], latent[start:end], images))
+
+        done = {}
+        next_index = 0
+        try:
+            while next_index < len(shards):
+                try:
+                    result_job, index, out = self.results.get(timeout=1)
+                except queue.Empty:
+                    if not all(worker.is_alive() for worker in self.workers):
+                        raise RuntimeError('a cpu worker exited unexpectedly')
+                    continue
+                if result_job is None:
+                    raise RuntimeError('cpu worker failed to start:\n%s' % out)
+                # checked before the error, a failure in an abandoned job does not fail this one
+                if result_job != job:
+                    continue
+                if isinstance(out, str):
+                    raise RuntimeError('cpu worker failed:\n%s' % out)
+                done[index] = out
+                while next_index in done:
+                    i, start, _ = shards[next_index]
+                    yield i * num_frames + start, done.pop(next_index)
+                    next_index += 1
+        finally:
+            # a stream that is closed early (e.g. by util.BackgroundGenerator.close) stops its shards right away
+            if self.current_job.value == job:
+                self.current_job.value = 0
+
+    def infer(self, input, target_age_features, traverse=False, deploy=False, interp_step=0.5, target_latent=None,
+              schedule=None, chunk_size=None, memory_budget=None):
+        if traverse:
+            if schedule is None:
+                schedule = networks.traversal_schedule(target_latent.shape[0], interp_step)
+            target_latent = networks.interpolate_latents(target_latent, *schedule)
+
+        out = [frames for _, frames in self.iter_infer(input, target_latent, chunk_size, memory_budget)]
+        return torch.cat(out, 0)
+
+    def iter_infer(self, input, target_latent, chunk_size=None, memory_budget=None):
+        return self.run(input, target_latent, chunk_size, memory_budget)
+
+    def iter_images(self, input, target_latent, chunk_size=None, memory_budget=None):
+        # like iter_infer, with the frames converted to uint8 H x W x C images by the workers
+        return self.run(input, target_latent, chunk_size, memory_budget, images=True)
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        shutil.rmtree(self.weights_dir, ignore_errors=True)
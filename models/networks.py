@@ -4,7 +4,12 @@ import torch
 import torch.nn as nn
 import torch.nn.init as init
 import torch.nn.functional as F
+import copy
 import functools
+import inspect
+import hashlib
+import contextlib
+from collections import OrderedDict
 from torch.autograd import grad as Grad
 from torch.autograd import Function
 import numpy as np
@@ -36,6 +41,80 @@ def weights_init(init_type='gaussian'):
     return init_fun
 
 
+def ease(progress, easing='linear'):
+    # maps the progress within a traversal segment ([0,1]) to an eased progress
+    if easing == 'linear':
+        return progress
+    elif easing == 'smoothstep':
+        return progress * progress * (3 - 2 * progress)
+    elif easing == 'cosine':
+        return 0.5 - 0.5 * torch.cos(progress * np.pi)
+    else:
+        raise NotImplementedError('easing [%s] is not implemented' % easing)
+
+def traversal_schedule(num_keyframes, interp_step=0.5, segment_frames=None, easing='linear'):
+    # describes every frame of a latent traversal through num_keyframes W vectors by the segment
+    # it belongs to and the weight of the segment's first keyframe (1 at the keyframe itself).
+    # by default every segment gets the frames of torch.arange(1,0,step=-interp_step), otherwise
+    # segment_frames gives the number of frames of each segment. the last keyframe closes the traversal.
+    num_segments = max(num_keyframes - 1, 0)
+    if segment_frames is None:
+        seg_alphas = [torch.arange(1,0,step=-interp_step)] * num_segments
+    else:
+        assert len(segment_frames) == num_segments, \
+            'expected %d segment frame counts, got %d' % (num_segments, len(segment_frames))
+        seg_alphas = [1 - torch.arange(n, dtype=torch.float32) / max(n, 1) for n in segment_frames]
+
+    if easing != 'linear':
+        seg_alphas = [1 - ease(1 - alphas, easing) for alphas in seg_alphas]
+
+    segments = [torch.full((len(alphas),), i, dtype=torch.long) for i, alphas in enumerate(seg_alphas)]
+    segments = torch.cat(segments + [torch.full((1,), max(num_segments - 1, 0), dtype=torch.long)])
+    alphas = torch.cat(seg_alphas + [torch.full((1,), 0.0 if num_segments > 0 else 1.0)])
+    return segments, alphas
+
+def allocate_frames(deltas, num_frames):
+    # splits a traversal of num_frames frames (including the closing keyframe) into per segment frame
+    # counts proportional to the change of each segment (e.g. the pixel difference of its keyframes).
+    # every segment keeps at least its keyframe, the rest is distributed by largest remainder
+    num_segments = len(deltas)
+    spare = max(num_frames - 1 - num_segments, 0)
+    deltas = [max(float(delta), 0.0) for delta in deltas]
+    total = sum(deltas)
+    if total <= 0:
+        deltas, total = [1.0] * num_segments, float(num_segments)
+    shares = [delta / total * spare for delta in deltas]
+    counts = [int(share) for share in shares]
+    remainders = sorted(range(num_segments), key=lambda i: counts[i] - shares[i])
+    for i in remainders[:spare - sum(counts)]:
+        counts[i] += 1
+    return [count + 1 for count in counts]
+
+def keyframe_indices(alphas):
+    # frames of a traversal schedule that show a keyframe exactly (the last frame closes the traversal)
+    indices = (alphas == 1).nonzero().view(-1).tolist()
+    return sorted(set(indices + [len(alphas) - 1]))
+
+def progressive_order(num_frames, keyframes=()):
+    # coarse to fine rendering order of num_frames frames: the first pass holds the keyframes (and both
+    # ends), every following pass the midpoints of the gaps left by the previous passes. returns the passes
+    rendered = sorted(set(list(keyframes) + [0, num_frames - 1]))
+    rendered = [i for i in rendered if 0 <= i < num_frames]
+    passes = [rendered]
+    while len(rendered) < num_frames:
+        midpoints = [(a + b) // 2 for a, b in zip(rendered[:-1], rendered[1:]) if b - a > 1]
+        passes.append(midpoints)
+        rendered = sorted(rendered + midpoints)
+    return passes
+
+def interpolate_latents(keyframes, segments, alphas):
+    # builds all frame latents of a traversal schedule in one batched op
+    segments = segments.to(keyframes.device)
+    alphas = alphas.to(keyframes).view(-1, 1)
+    start = keyframes[segments]
+    end = keyframes[(segments + 1).clamp(max=keyframes.shape[0] - 1)]
+    return alphas * start + (1 - alphas) * end
+
 def get_norm_layer(norm_type='instance'):
     if norm_type == 'instance':
         norm_layer = functools.partial(nn.InstanceNorm2d, affine=False)
@@ -49,15 +128,31 @@ def define_G(input_nc, output_nc, ngf, n_downsample_global=2,
              id_enc_norm='pixel', gpu_ids=[], padding_type='reflect',
              style_dim=50, init_type='gaussian',
              conv_weight_norm=False, decoder_norm='pixel', activation='lrelu',
-             adaptive_blocks=4, normalize_mlp=False, modulated_conv=False):
+             adaptive_blocks=4, normalize_mlp=False, modulated_conv=False, inference_only=False):
 
     id_enc_norm = get_norm_layer(norm_type=id_enc_norm)
 
-    netG = Generator(input_nc, output_nc, ngf, n_downsampling=n_downsample_global,
-                     id_enc_norm=id_enc_norm, padding_type=padding_type, style_dim=style_dim,
-                     conv_weight_norm=conv_weight_norm, decoder_norm=decoder_norm,
-                     actvn=activation, adaptive_blocks=adaptive_blocks,
-                     normalize_mlp=normalize_mlp, modulated_conv=modulated_conv)
+    build_generator = functools.partial(Generator, input_nc, output_nc, ngf, n_downsampling=n_downsample_global,
+                                        id_enc_norm=id_enc_norm, padding_type=padding_type, style_dim=style_dim,
+                                        conv_weight_norm=conv_weight_norm, decoder_norm=decoder_norm,
+                                        actvn=activation, adaptive_blocks=adaptive_blocks,
+                                        normalize_mlp=normalize_mlp, modulated_conv=modulated_conv,
+                                        inference_only=inference_only)
+
+    if inference_only:
+        # the weights are overwritten by the checkpoint, so they are neither printed nor initialized.
+        # when supported, the generator is built on the meta device (no storage is allocated) and
+        # load_network assigns the checkpoint tensors to it
+        if meta_init_supported():
+            with torch.device('meta'):
+                return build_generator()
+        netG = build_generator()
+        if len(gpu_ids) > 0:
+            assert(torch.cuda.is_available())
+            netG.cuda(gpu_ids[0])
+        return netG
+
+    netG = build_generator()
 
     print(netG)
     if len(gpu_ids) > 0:
@@ -68,6 +163,13 @@ def define_G(input_nc, output_nc, ngf, n_downsample_global=2,
 
     return netG
 
+def meta_init_supported():
+    # building modules on the meta device and assigning loaded tensors requires torch >= 2.1
+    return 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+def is_meta(network):
+    return any(param.is_meta for param in network.parameters())
+
 def define_D(input_nc, ndf, n_layers=6, numClasses=2, gpu_ids=[],
              init_type='gaussian'):
 
@@ -196,7 +298,9 @@ class PixelNorm(nn.Module):
         # it has no actual use
 
     def forward(self, input):
-        return input / torch.sqrt(torch.mean(input ** 2, dim=1, keepdim=True) + 1e-5)
+        # computed in fp32 for half/bfloat16 inputs (reduced precision inference), the output keeps the input dtype
+        x = input.float()
+        return (x / torch.sqrt(torch.mean(x ** 2, dim=1, keepdim=True) + 1e-5)).to(input.dtype)
 
 class ModulatedConv2d(nn.Module):
     def __init__(self, fin, fout, kernel_size, padding_type='reflect', upsample=False, downsample=False, latent_dim=256, normalize_mlp=False):
@@ -212,10 +316,11 @@ class ModulatedConv2d(nn.Module):
         else:
             self.demudulate = True
 
-        self.weight = nn.Parameter(torch.Tensor(fout, fin, kernel_size, kernel_size))
-        self.bias = nn.Parameter(torch.Tensor(1, fout, 1, 1))
+        self.weight = nn.Parameter(torch.empty(fout, fin, kernel_size, kernel_size))
+        self.bias = nn.Parameter(torch.empty(1, fout, 1, 1))
         self.conv = F.conv2d
 
+        self.normalize_mlp = normalize_mlp
         if normalize_mlp:
             self.mlp_class_std = nn.Sequential(EqualLinear(latent_dim, fin), PixelNorm())
         else:
@@ -236,17 +341,85 @@ class ModulatedConv2d(nn.Module):
 
         self.weight.data.normal_()
         self.bias.data.zero_()
-
-    def forward(self, input, latent):
+        self.impl = 'auto'
+        # set by freeze_for_inference: self.weight already holds the scaled weight and
+        # demod_weight the per (out, in) channel sums of its squares used for demodulation
+        self.prescaled = False
+        self.register_buffer('demod_weight', None)
+        # set by quantization.quantize_decoder_weights: int8 weight and per output channel scale.
+        # the weights are frozen, so they are dequantized once (weight_dequantized) and not in every forward
+        self.register_buffer('weight_int8', None)
+        self.register_buffer('weight_scale', None)
+        self.weight_dequantized = None
+
+    def use_shared_weight(self, batch_size):
+        # the shared weight formulation runs one regular conv for the whole batch instead of a grouped conv
+        # with groups=batch_size, which is much faster for inference batches (traverse/deploy frames).
+        # in training the original grouped formulation is kept unless explicitly requested
+        if self.impl == 'shared':
+            return True
+        elif self.impl == 'grouped':
+            return False
+        else:
+            return (not self.training) and batch_size > 1
+
+    def scaled_weight(self):
+        if self.weight_int8 is not None:
+            if self.weight_dequantized is None:
+                self.weight_dequantized = self.weight_int8.float() * self.weight_scale.view(-1, 1, 1, 1)
+            return self.weight_dequantized
+        if self.prescaled:
+            return self.weight
         fan_in = self.weight.data.size(1) * self.weight.data[0][0].numel()
-        weight = self.weight * sqrt(2 / fan_in)
-        weight = weight.view(1, self.out_channels, self.in_channels, self.kernel_size, self.kernel_size)
+        return self.weight * sqrt(2 / fan_in)
+
+    def demodulation(self, s, weight):
+        # always in fp32, also inside a reduced precision autocast region
+        with full_precision(s.device.type):
+            if self.demod_weight is not None:
+                weight_sq = self.demod_weight.float()
+            else:
+                weight_sq = (weight.float() ** 2).sum(3).sum(2).t()
+            return torch.rsqrt(torch.matmul(s.float() ** 2, weight_sq) + 1e-5)
 
-        s = 1 + self.mlp_class_std(latent).view(-1, 1, self.in_channels, 1, 1)
-        weight = s * weight
+    def style_linear(self):
+        # the EqualLinear layer of mlp_class_std that projects the latent to the modulation of this layer
+        if self.normalize_mlp:
+            return self.mlp_class_std[0]
+        else:
+            return self.mlp_class_std
+
+    def modulation(self, style):
+        # modulation s (b x in) and demodulation d (b x out, None without demodulation) from the output
+        # of style_linear. d = rsqrt(sum_i,k (s_i * w_oik)^2) = rsqrt(s^2 @ (sum_k w_oik^2)^T)
+        if self.normalize_mlp:
+            style = self.mlp_class_std[1](style)
+        s = 1 + style.view(-1, self.in_channels)
         if self.demudulate:
-            d = torch.rsqrt((weight ** 2).sum(4).sum(3).sum(2) + 1e-5).view(-1, self.out_channels, 1, 1, 1)
-            weight = (d * weight).view(-1, self.in_channels, self.kernel_size, self.kernel_size)
+            d = self.demodulation(s, self.scaled_weight())
+        else:
+            d = None
+        return s, d
+
+    def forward(self, input, latent, style=None):
+        # style optionally holds the precomputed (s, d) pair of this layer (see StyledDecoder.precompute_styles),
+        # in which case latent is not used
+        weight = self.scaled_weight()
+
+        if style is None:
+            s = 1 + self.mlp_class_std(latent).view(-1, self.in_channels)
+            d = None
+        else:
+            s, d = style
+        if self.use_shared_weight(s.shape[0]):
+            return self.forward_shared(input, weight, s, d)
+
+        weight = weight.view(1, self.out_channels, self.in_channels, self.kernel_size, self.kernel_size)
+        weight = s.view(-1, 1, self.in_channels, 1, 1) * weight
+        if self.demudulate:
+            if d is None:
+                d = torch.rsqrt((weight.float() ** 2).sum(4).sum(3).sum(2) + 1e-5)
+            weight = (d.view(-1, self.out_channels, 1, 1, 1) * weight).view(-1, self.in_channels, self.kernel_size, self.kernel_size)
         else:
             weight = weight.view(-1, self.in_channels, self.kernel_size, self.kernel_size)
 
@@ -256,8 +429,9 @@ class ModulatedConv2d(nn.Module):
         if self.downsample:
             input = self.blur(input)
 
-        b,_,h,w = input.shape
-        input = input.view(1,-1,h,w)
+        b = s.shape[0]
+        _,_,h,w = input.shape
+        input = input.expand(b, -1, h, w).reshape(1,-1,h,w)
         input = self.padding(input)
         out = self.conv(input, weight, groups=b).view(b, self.out_channels, h, w) + self.bias
 
@@ -269,6 +443,132 @@ class ModulatedConv2d(nn.Module):
 
         return out
 
+    def forward_shared(self, input, weight, s, d=None):
+        # conv(x, s * w) * d == conv(s * x, w) * d: modulate the activations instead of the weights,
+        # run a single conv with the shared weight and apply the demodulation as a per sample output scale.
+        # the modulation is a per channel scale that commutes with upsampling/blurring/padding, so it is applied
+        # where the activations are smallest: before those ops for a batch of inputs, and after them for a
+        # single input shared by all styles (traverse/deploy identity features), which is only broadcast here
+        b = s.shape[0]
+        scale = s.view(b, self.in_channels, 1, 1)
+        shared_input = input.shape[0] != b
+        if not shared_input:
+            input = input * scale
+
+        if self.upsample:
+            input = self.upsampler(input)
+
+        if self.downsample:
+            input = self.blur(input)
+
+        input = self.padding(input)
+        if shared_input:
+            input = input * scale
+
+        out = self.conv(input, weight)
+        if self.demudulate:
+            if d is None:
+                d = self.demodulation(s, weight)
+            out = out * d.view(b, self.out_channels, 1, 1)
+        out = out + self.bias
+
+        if self.downsample:
+            out = self.downsampler(out)
+
+        if self.upsample:
+            out = self.blur(out)
+
+        return out
+
+def fold_padding(model):
+    # replaces every padding layer that is directly followed by a conv in an nn.Sequential with the conv's own
+    # padding. the padding layer is swapped for nn.Identity so that the module indices (and state dict keys) stay the same
+    padding_modes = [(nn.ReflectionPad2d, 'reflect'), (nn.ReplicationPad2d, 'replicate'), (nn.ZeroPad2d, 'zeros')]
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        # indexed directly: children() skips repeated modules (e.g. a shared activation), which would
+        # shift the indices against module[i]
+        for i in range(len(module) - 1):
+            pad, conv = module[i], module[i + 1]
+            if isinstance(conv, EqualConv2d):
+                conv = conv.conv
+            if not isinstance(conv, nn.Conv2d) or conv.padding_mode != 'zeros' or any(p != 0 for p in conv.padding):
+                continue
+            padding_mode = None
+            for pad_type, mode in padding_modes:
+                if type(pad) == pad_type:
+                    padding_mode = mode
+            if padding_mode is None:
+                continue
+            padding = tuple(pad.padding) if isinstance(pad.padding, (tuple, list)) else (pad.padding,) * 4
+            if len(set(padding)) != 1:
+                continue
+            conv.padding = (padding[0], padding[0])
+            conv.padding_mode = padding_mode
+            conv._reversed_padding_repeated_twice = [padding[0]] * 4
+            module[i] = nn.Identity()
+
+def freeze_for_inference(model):
+    # turns a loaded generator into an inference only module that computes the same outputs:
+    # bakes the equalized learning rate scaling into the weights and removes the EqualLR hooks,
+    # folds padding layers into the following convs, prescales the ModulatedConv2d weights and
+    # precomputes their demodulation buffers. the state dict keys change (weight_orig -> weight),
+    # so this is applied after loading the checkpoint
+    model.eval()
+    for module in model.modules():
+        hooks = [key for key, hook in module._forward_pre_hooks.items() if isinstance(hook, EqualLR)]
+        for key in hooks:
+            hook = module._forward_pre_hooks.pop(key)
+            weight = hook.compute_weight(module).detach()
+            del module._parameters[hook.name + '_orig']
+            if hook.name in module.__dict__:
+                del module.__dict__[hook.name]
+            module.register_parameter(hook.name, nn.Parameter(weight))
+
+        if isinstance(module, ModulatedConv2d) and not module.prescaled:
+            module.weight.data = module.scaled_weight().detach()
+            module.prescaled = True
+            module.demod_weight = (module.weight.detach() ** 2).sum(3).sum(2).t().contiguous()
+
+    fold_padding(model)
+    for param in model.parameters():
+        param.requires_grad_(False)
+    for module in model.modules():
+        if isinstance(module, StyledDecoder):
+            module.clear_style_cache()
+    model.frozen = True
+    return model
+
+def slice_styles(styles, start, end):
+    # the precomputed (s, d) pairs of latents start:end
+    return [(s[start:end], d[start:end] if d is not None else None) for s, d in styles]
+
+PRECISIONS = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+def autocast(device_type, precision='fp32'):
+    # autocast region of an inference precision: fp32 (no autocast), fp16 or bf16.
+    # PixelNorm and the modulated conv demodulation run in fp32 inside it
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, dtype=PRECISIONS[precision])
+
+def full_precision(device_type):
+    # disables an enclosing autocast region
+    if not hasattr(torch, 'autocast') or not torch.is_autocast_enabled() and not torch.is_autocast_cpu_enabled():
+        return contextlib.nullcontext()
+    return torch.autocast(device_type, enabled=False)
+
+def select_styles(styles, index):
+    # the precomputed (s, d) pairs of the latents in index
+    return [(s.index_select(0, index), d.index_select(0, index) if d is not None else None) for s, d in styles]
+
+def set_modulated_conv_impl(model, impl='auto'):
+    # selects the ModulatedConv2d formulation of every layer in model: 'grouped', 'shared' or 'auto'
+    for module in model.modules():
+        if isinstance(module, ModulatedConv2d):
+            module.impl = impl
+
 class EqualConv2d(nn.Module):
     def __init__(self, *args, **kwargs):
         super().__init__()
@@ -295,6 +595,13 @@ class EqualLinear(nn.Module):
     def forward(self, input):
         return self.linear(input)
 
+    def scaled_weight(self):
+        # the weight as used in forward, i.e. with the equalized learning rate scaling applied
+        if hasattr(self.linear, 'weight_orig'):
+            return EqualLR('weight').compute_weight(self.linear)
+        else:
+            return self.linear.weight
+
 class BlurFunctionBackward(Function):
     @staticmethod
     def forward(ctx, grad_output, kernel, kernel_flip):
@@ -348,6 +655,9 @@ class Blur(nn.Module):
         self.register_buffer('weight_flip', weight_flip.repeat(channel, 1, 1, 1))
 
     def forward(self, input):
+        # the custom autograd function is only needed for the (double) backward pass
+        if not torch.is_grad_enabled() or not input.requires_grad:
+            return F.conv2d(input, self.weight, padding=1, groups=input.shape[1])
         return blur(input, self.weight, self.weight_flip)
 
 class MLP(nn.Module):
@@ -464,9 +774,10 @@ class StyledConvBlock(nn.Module):
 
         self.actvn1 = activation
 
-    def forward(self, input, latent=None):
+    def forward(self, input, latent=None, styles=(None, None)):
+        # styles holds the optional precomputed (s, d) pairs of conv0 and conv1
         if self.modulated_conv:
-            out = self.conv0(input,latent)
+            out = self.conv0(input,latent,style=styles[0])
         else:
             out = self.conv0(input)
 
@@ -475,7 +786,7 @@ class StyledConvBlock(nn.Module):
             out = self.pxl_norm0(out)
 
         if self.modulated_conv:
-            out = self.conv1(out,latent)
+            out = self.conv1(out,latent,style=styles[1])
         else:
             out = self.conv1(out)
 
@@ -563,6 +874,16 @@ class AgeEncoder(nn.Module):
         latent = features.mean(dim=3).mean(dim=2)
         return latent
 
+def style_cache_key(latent):
+    # cpu latents are keyed by content, so equal latents (e.g. a recomputed traversal schedule) share an entry.
+    # hashing a gpu latent would copy it to the host and synchronize on every decode, so those are keyed by
+    # their memory and version counter (bumped by in place changes) instead
+    if latent.device.type == 'cpu':
+        content = hashlib.sha1(latent.detach().float().contiguous().numpy().tobytes()).hexdigest()
+    else:
+        content = (latent.data_ptr(), latent.stride(), latent._version)
+    return (content, tuple(latent.shape), str(latent.dtype), str(latent.device))
+
 class StyledDecoder(nn.Module):
     def __init__(self, output_nc, ngf=64, style_dim=50, latent_dim=256, n_downsampling=2,
                  padding_type='reflect', actvn='lrelu', use_tanh=True, use_pixel_norm=False,
@@ -575,6 +896,9 @@ class StyledDecoder(nn.Module):
 
         mult = 2**n_downsampling
         last_upconv_out_layers = ngf * mult // 4
+        self.n_upsampling = 2
+        self.last_upconv_layers = (ngf * mult // 2, last_upconv_out_layers)
+        self.modulated_conv = modulated_conv
 
         self.StyledConvBlock_0 = StyledConvBlock(ngf * mult, ngf * mult, latent_dim=latent_dim,
                                                  padding=padding_type, actvn=actvn,
@@ -614,35 +938,162 @@ class StyledDecoder(nn.Module):
         self.conv_img = nn.Sequential(EqualConv2d(last_upconv_out_layers, output_nc, 1), nn.Tanh())
         self.mlp = MLP(style_dim, latent_dim, 256, 8, weight_norm=True, activation=actvn, normalize_mlp=normalize_mlp)
 
-    def forward(self, id_features, target_age=None, traverse=False, deploy=False, interp_step=0.5):
-        if target_age is not None:
+        # per latent cache of precomputed styles, disabled (None) unless enable_style_cache is called
+        self.style_cache = None
+        self.style_cache_size = 0
+        self.fused_style_projection = None
+        # optional nn.Linear (or quantized linear) module that replaces the fused style projection
+        self.style_projection_layer = None
+
+    def styled_blocks(self):
+        return [self.StyledConvBlock_0, self.StyledConvBlock_1, self.StyledConvBlock_2,
+                self.StyledConvBlock_3, self.StyledConvBlock_up0, self.StyledConvBlock_up1]
+
+    def modulated_convs(self):
+        # all ModulatedConv2d layers in the order they are applied
+        convs = []
+        for block in self.styled_blocks():
+            convs += [block.conv0, block.conv1]
+        return convs
+
+    def enable_style_cache(self, size=16):
+        # caches the precomputed styles of the last size latent batches. only valid while the weights
+        # are fixed, i.e. for inference models, the fused projection weights are cached as well
+        self.style_cache = OrderedDict()
+        self.style_cache_size = size
+        self.fused_style_projection = None
+
+    def clear_style_cache(self):
+        if self.style_cache is not None:
+            self.style_cache.clear()
+        self.fused_style_projection = None
+
+    def style_projection(self):
+        # the mlp_class_std linear layers of all modulated convs stacked into a single weight and bias
+        if self.fused_style_projection is not None:
+            return self.fused_style_projection
+        linears = [conv.style_linear() for conv in self.modulated_convs()]
+        weight = torch.cat([linear.scaled_weight() for linear in linears], 0)
+        bias = torch.cat([linear.linear.bias for linear in linears], 0)
+        if self.style_cache is not None:
+            self.fused_style_projection = (weight.detach(), bias.detach())
+        return weight, bias
+
+    def project_styles(self, latent):
+        # (s, d) of every modulated conv for every row of latent, with a single matmul for all layers
+        convs = self.modulated_convs()
+        if self.style_projection_layer is not None:
+            styles = self.style_projection_layer(latent)
+        else:
+            weight, bias = self.style_projection()
+            styles = F.linear(latent, weight, bias)
+        styles = styles.split([conv.in_channels for conv in convs], dim=1)
+        return [conv.modulation(style) for conv, style in zip(convs, styles)]
+
+    def precompute_styles(self, latent):
+        # cached project_styles. returns None when the cache is disabled (training) so that every
+        # layer runs its own mlp_class_std as before
+        if self.style_cache is None or latent is None or not self.modulated_conv:
+            return None
+        key = style_cache_key(latent)
+        if key in self.style_cache:
+            self.style_cache.move_to_end(key)
+            return self.style_cache[key][1]
+        with torch.no_grad():
+            styles = self.project_styles(latent)
+        # the entry keeps the latent alive, so its memory (and data_ptr) cannot be reused by another tensor
+        self.style_cache[key] = (latent, styles)
+        while len(self.style_cache) > self.style_cache_size:
+            self.style_cache.popitem(last=False)
+        return styles
+
+    def frame_memory(self, id_features):
+        # rough estimate (in bytes) of the peak activation memory of decoding a single frame.
+        # the peak is reached in the last upsampling block, which holds the upsampled and padded
+        # input and a few full resolution outputs (conv, blur, activation, pixel norm)
+        h = id_features.shape[2] * 2 ** self.n_upsampling
+        w = id_features.shape[3] * 2 ** self.n_upsampling
+        fin, fout = self.last_upconv_layers
+        return (2 * fin + 4 * fout) * h * w * id_features.element_size()
+
+    def forward(self, id_features, target_age=None, traverse=False, deploy=False, interp_step=0.5, target_latent=None,
+                schedule=None, chunk_size=None):
+        # target_latent holds precomputed mapping network outputs (W) that are used instead of
+        # running self.mlp on target_age, e.g. rows of a per class style table.
+        # schedule is a (segments, alphas) pair from traversal_schedule, by default uniform steps of interp_step.
+        # in traverse/deploy mode, chunk_size caps the number of frames that are decoded in a single batch
+        if target_latent is None and target_age is not None:
+            target_latent = self.mlp(target_age)
+
+        if target_latent is not None:
             if traverse:
-                alphas = torch.arange(1,0,step=-interp_step).view(-1,1).cuda()
-                interps = len(alphas)
-                orig_class_num = target_age.shape[0]
-                output_classes = interps * (orig_class_num - 1) + 1
-                temp_latent = self.mlp(target_age)
-                latent = temp_latent.new_zeros((output_classes, temp_latent.shape[1]))
+                if schedule is None:
+                    schedule = traversal_schedule(target_latent.shape[0], interp_step)
+                latent = interpolate_latents(target_latent, *schedule)
+                output_classes = latent.shape[0]
             else:
-                latent = self.mlp(target_age)
+                latent = target_latent
         else:
             latent = None
 
-        if traverse:
-            id_features = id_features.repeat(output_classes,1,1,1)
-            for i in range(orig_class_num-1):
-                latent[interps*i:interps*(i+1), :] = alphas * temp_latent[i,:] + (1 - alphas) * temp_latent[i+1,:]
-            latent[-1,:] = temp_latent[-1,:]
-        elif deploy:
-            output_classes = target_age.shape[0]
-            id_features = id_features.repeat(output_classes,1,1,1)
-
-        out = self.StyledConvBlock_0(id_features, latent)
-        out = self.StyledConvBlock_1(out, latent)
-        out = self.StyledConvBlock_2(out, latent)
-        out = self.StyledConvBlock_3(out, latent)
-        out = self.StyledConvBlock_up0(out, latent)
-        out = self.StyledConvBlock_up1(out, latent)
+        # in traverse/deploy mode id_features holds a single identity that is shared by all latents
+        if traverse or deploy:
+            output_classes = latent.shape[0]
+            if chunk_size is not None and chunk_size > 0 and output_classes > chunk_size:
+                out = None
+                for start, out_chunk in self.iter_decode(id_features, latent, chunk_size):
+                    if out is None:
+                        out = out_chunk.new_empty((output_classes,) + out_chunk.shape[1:])
+                    out[start:start + out_chunk.shape[0]] = out_chunk
+                return out
+
+        return self.decode_latents(id_features, latent, self.precompute_styles(latent))
+
+    def chunk_frames(self, id_features, chunk_size=None, memory_budget=None):
+        # number of frames per decoder batch given a frame cap and a memory budget in bytes (0/None = no limit)
+        if memory_budget is not None and memory_budget > 0:
+            budget_chunk = max(1, int(memory_budget // self.frame_memory(id_features)))
+            chunk_size = budget_chunk if not chunk_size else min(chunk_size, budget_chunk)
+        return chunk_size
+
+    def iter_decode(self, id_features, latent, chunk_size=None):
+        # decodes every identity in id_features with every row of latent, chunk_size frames at a time.
+        # frames are ordered by identity, then by latent (frame k of identity i is frame i * num_latents + k).
+        # yields the index of the first frame of each chunk and the decoded chunk
+        num_ids = id_features.shape[0]
+        num_latents = latent.shape[0]
+        num_frames = num_ids * num_latents
+        if not chunk_size:
+            chunk_size = num_frames
+        # styles are projected once for the whole latent batch and sliced per chunk
+        styles = self.precompute_styles(latent)
+        for start in range(0, num_frames, chunk_size):
+            end = min(start + chunk_size, num_frames)
+            first_id, last_id = start // num_latents, (end - 1) // num_latents
+            if first_id == last_id:
+                # a single identity, broadcast to all latents of the chunk
+                chunk_start = start - first_id * num_latents
+                chunk_end = end - first_id * num_latents
+                chunk_styles = slice_styles(styles, chunk_start, chunk_end) if styles is not None else None
+                out = self.decode_latents(id_features[first_id:first_id + 1], latent[chunk_start:chunk_end], chunk_styles)
+            else:
+                index = torch.arange(start, end, device=latent.device)
+                ids, latent_index = index // num_latents, index % num_latents
+                chunk_styles = select_styles(styles, latent_index) if styles is not None else None
+                out = self.decode_latents(id_features.index_select(0, ids), latent.index_select(0, latent_index), chunk_styles)
+            yield start, out
+
+    def decode_latents(self, id_features, latent, styles=None):
+        # run the styled conv blocks, one latent per id_features sample. a single identity is broadcast
+        # to all latents inside the first modulated conv instead of being copied for every frame.
+        # styles optionally holds the precomputed (s, d) pairs of all modulated convs for latent
+        if id_features.shape[0] == 1 and latent is not None and latent.shape[0] > 1 and not self.modulated_conv:
+            id_features = id_features.expand(latent.shape[0], -1, -1, -1)
+        if styles is None:
+            styles = [None] * 2 * len(self.styled_blocks())
+        out = id_features
+        for i, block in enumerate(self.styled_blocks()):
+            out = block(out, latent, styles[2 * i:2 * i + 2])
         out = self.conv_img(out)
 
         return out
@@ -652,14 +1103,22 @@ class Generator(nn.Module):
                  n_blocks=4, adaptive_blocks=4, id_enc_norm=PixelNorm,
                  padding_type='reflect', conv_weight_norm=False,
                  decoder_norm='pixel', actvn='lrelu', normalize_mlp=False,
-                 modulated_conv=False):
+                 modulated_conv=False, inference_only=False):
         super(Generator, self).__init__()
         self.id_encoder = IdentityEncoder(input_nc, ngf, n_downsampling, n_blocks, id_enc_norm,
                                           padding_type, conv_weight_norm=conv_weight_norm,
                                           actvn='relu') # replacing relu with leaky relu here causes nans and the entire training to collapse immediately
-        self.age_encoder = AgeEncoder(input_nc, ngf=ngf, n_downsampling=4, style_dim=style_dim,
-                                      padding_type=padding_type, actvn=actvn,
-                                      conv_weight_norm=conv_weight_norm)
+        # the age encoder is only used for training losses, inference only generators are built without it
+        if inference_only:
+            self.age_encoder = None
+        else:
+            self.age_encoder = AgeEncoder(input_nc, ngf=ngf, n_downsampling=4, style_dim=style_dim,
+                                          padding_type=padding_type, actvn=actvn,
+                                          conv_weight_norm=conv_weight_norm)
+
+        # optional util.IdentityFeatureCache consulted by encode_identity, see LATS.set_identity_cache
+        self.id_cache = None
+        self.id_cache_name = ''
 
         use_pixel_norm = decoder_norm == 'pixel'
         self.decoder = StyledDecoder(output_nc, ngf=ngf, style_dim=style_dim,
@@ -671,14 +1130,16 @@ class Generator(nn.Module):
     def encode(self, input):
         if torch.is_tensor(input):
             id_features = self.id_encoder(input)
-            age_features = self.age_encoder(input)
+            age_features = self.age_encoder(input) if self.age_encoder is not None else None
             return id_features, age_features
         else:
             return None, None
 
-    def decode(self, id_features, target_age_features, traverse=False, deploy=False, interp_step=0.5):
+    def decode(self, id_features, target_age_features, traverse=False, deploy=False, interp_step=0.5, target_latent=None,
+               schedule=None, chunk_size=None):
         if torch.is_tensor(id_features):
-            return self.decoder(id_features, target_age_features, traverse=traverse, deploy=deploy, interp_step=interp_step)
+            return self.decoder(id_features, target_age_features, traverse=traverse, deploy=deploy, interp_step=interp_step,
+                                target_latent=target_latent, schedule=schedule, chunk_size=chunk_size)
         else:
             return None
 
@@ -703,11 +1164,71 @@ class Generator(nn.Module):
         return rec_out, gen_out, cyc_out, orig_id_features, orig_age_features, fake_id_features, fake_age_features
 
 
-    def infer(self, input, target_age_features, traverse=False, deploy=False, interp_step=0.5):
-        id_features = self.id_encoder(input)
-        out = self.decode(id_features, target_age_features, traverse=traverse, deploy=deploy, interp_step=interp_step)
+    def encode_identity(self, input):
+        # id_encoder output of input, looked up in the identity feature cache when one is attached.
+        # cached features are fp16, so a cache miss returns the same rounded features as later hits
+        if self.id_cache is None:
+            return self.id_encoder(input)
+        key = self.id_cache.key(input, self.id_cache_name)
+        id_features = self.id_cache.get(key)
+        if id_features is None:
+            id_features = self.id_cache.put(key, self.id_encoder(input))
+        return id_features.to(device=input.device, dtype=input.dtype)
+
+    def infer(self, input, target_age_features, traverse=False, deploy=False, interp_step=0.5, target_latent=None,
+              schedule=None, chunk_size=None, memory_budget=None):
+        # memory_budget (in bytes) further limits chunk_size in traverse/deploy mode
+        id_features = self.encode_identity(input)
+        chunk_size = self.decoder.chunk_frames(id_features, chunk_size, memory_budget)
+        out = self.decode(id_features, target_age_features, traverse=traverse, deploy=deploy, interp_step=interp_step,
+                          target_latent=target_latent, schedule=schedule, chunk_size=chunk_size)
         return out
 
+    def infer_targets(self, input, target_age_features):
+        # decodes every input image with several target conditions (num_targets x batch x cond_length),
+        # running the identity encoder once. returns num_targets x batch x C x H x W
+        id_features = self.encode_identity(input)
+        num_targets, batch = target_age_features.shape[:2]
+        # a single image is broadcast to all targets by the decoder
+        if batch > 1:
+            id_features = id_features.repeat(num_targets, 1, 1, 1)
+        out = self.decode(id_features, target_age_features.reshape(num_targets * batch, -1))
+        return out.view((num_targets, batch) + out.shape[1:])
+
+    def iter_infer(self, input, target_latent, chunk_size=None, memory_budget=None):
+        # streaming version of infer for traverse/deploy: encodes the identities once and yields
+        # (first frame index, frames) for every decoded chunk of the per frame latents in target_latent.
+        # with several input images, the frames of all images are decoded in shared chunks (see iter_decode)
+        id_features = self.encode_identity(input)
+        chunk_size = self.decoder.chunk_frames(id_features, chunk_size, memory_budget)
+        for start, out in self.decoder.iter_decode(id_features, target_latent, chunk_size):
+            yield start, out
+
+    def map_styles(self, conditions):
+        # mapping network outputs (W) for the given conditions, e.g. one noise free condition per age class
+        return self.decoder.mlp(conditions)
+
+class InferenceGraph(nn.Module):
+    # the traverse/deploy subgraph of a Generator for export: encode the identity of an image and
+    # decode it with one mapping network output (W) per frame. all styles are projected with the
+    # fused style projection of the decoder and the modulated convs use the shared weight formulation,
+    # which is valid for any number of frames
+    def __init__(self, generator):
+        super(InferenceGraph, self).__init__()
+        self.id_encoder = generator.id_encoder
+        # switched to the shared formulation on a copy, the generator keeps its own (e.g. --modconv_impl)
+        self.decoder = copy.deepcopy(generator.decoder)
+        set_modulated_conv_impl(self.decoder, 'shared')
+
+    def encode(self, image):
+        return self.id_encoder(image)
+
+    def decode(self, id_features, latent):
+        return self.decoder.decode_latents(id_features, latent, self.decoder.project_styles(latent))
+
+    def forward(self, image, latent):
+        return self.decode(self.encode(image), latent)
+
 # Define a resnet block
 class ResnetBlock(nn.Module):
     def __init__(self, dim, padding_type, norm_layer, activation=nn.ReLU(True),
@@ -0,0 +1,88 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import numpy as np
+import torch
+from . import networks
+
+ENCODER_FILE = 'id_encoder.onnx'
+DECODER_FILE = 'decoder.onnx'
+
+
+def export_dir(opt):
+    # directory of the exported inference graphs of a model (see export.py)
+    if opt.export_dir:
+        return opt.export_dir
+    return os.path.join(opt.checkpoints_dir, opt.name, 'export')
+
+
+def create_session(path, threads=0):
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError('the onnx backend requires onnxruntime (pip install onnxruntime)')
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+class OnnxGenerator(object):
+    # runs the exported id_encoder and decoder graphs on ONNX Runtime CPU sessions.
+    # implements the traverse/deploy part of the Generator interface (infer, iter_infer); the mapping
+    # network and the per class style table stay in pytorch and only the per frame latents are passed in
+    def __init__(self, graph_dir, generator, threads=0):
+        self.encoder_session = create_session(os.path.join(graph_dir, ENCODER_FILE), threads)
+        self.decoder_session = create_session(os.path.join(graph_dir, DECODER_FILE), threads)
+        # the eager generator holds the identity feature cache (see LATS.set_identity_cache),
+        # its decoder is only used for the frame memory estimate of chunk_frames
+        self.generator = generator
+        self.decoder = generator.decoder
+
+    def run_encoder(self, input):
+        image = input.detach().cpu().float().numpy()
+        return self.encoder_session.run(None, {'image': image})[0]
+
+    def encode(self, input):
+        # like Generator.encode_identity, looked up in the identity feature cache when one is attached
+        cache = self.generator.id_cache
+        if cache is None:
+            return self.run_encoder(input)
+        key = cache.key(input, self.generator.id_cache_name)
+        id_features = cache.get(key)
+        if id_features is None:
+            id_features = cache.put(key, torch.from_numpy(self.run_encoder(input)))
+        return id_features.float().numpy()
+
+    def decode(self, id_features, latent):
+        return self.decoder_session.run(None, {'id_features': id_features, 'latent': latent})[0]
+
+    def chunk_frames(self, id_features, chunk_size=None, memory_budget=None):
+        id_features = torch.from_numpy(id_features[:1, :1])
+        return self.decoder.chunk_frames(id_features, chunk_size, memory_budget)
+
+    def infer(self, input, target_age_features, traverse=False, deploy=False, interp_step=0.5, target_latent=None,
+              schedule=None, chunk_size=None, memory_budget=None):
+        if traverse:
+            if schedule is None:
+                schedule = networks.traversal_schedule(target_latent.shape[0], interp_step)
+            target_latent = networks.interpolate_latents(target_latent, *schedule)
+
+        out = [frames for _, frames in self.iter_infer(input, target_latent, chunk_size, memory_budget)]
+        return torch.cat(out, 0)
+
+    def iter_infer(self, input, target_latent, chunk_size=None, memory_budget=None):
+        # the exported decoder broadcasts a single identity, several images are decoded one after the other
+        id_features = self.encode(input)
+        latent = target_latent.detach().cpu().float().numpy()
+        chunk_size = self.chunk_frames(id_features, chunk_size, memory_budget)
+        num_frames = latent.shape[0]
+        if not chunk_size:
+            chunk_size = num_frames
+        for i in range(id_features.shape[0]):
+            for start in range(0, num_frames, chunk_size):
+                end = min(start + chunk_size, num_frames)
+                frames = self.decode(id_features[i:i + 1], np.ascontiguousarray(latent[start:end]))
+                yield i * num_frames + start, torch.from_numpy(frames)
@@ -0,0 +1,139 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from . import networks
+
+QUANTIZE_PARTS = ['mapping', 'encoder', 'decoder']
+ENCODER_FILE = 'id_encoder_int8.pt'
+
+
+def parse_parts(quantize):
+    # comma separated subset of QUANTIZE_PARTS, or 'all'
+    if not quantize:
+        return []
+    parts = [part.strip() for part in quantize.split(',')]
+    if 'all' in parts:
+        return list(QUANTIZE_PARTS)
+    for part in parts:
+        if part not in QUANTIZE_PARTS:
+            raise ValueError('unknown quantization part [%s], expected one of %s or all' % (part, QUANTIZE_PARTS))
+    return parts
+
+
+def set_engine():
+    # fbgemm on x86, qnnpack on arm
+    engines = torch.backends.quantized.supported_engines
+    torch.backends.quantized.engine = 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+    return torch.backends.quantized.engine
+
+
+def quantize_mapping(generator):
+    # dynamic int8 quantization of the mapping network and of the style projections of all modulated convs.
+    # the style projections are first stacked into a single linear layer (see StyledDecoder.project_styles)
+    decoder = generator.decoder
+    set_engine()
+    with torch.no_grad():
+        weight, bias = decoder.style_projection()
+        layer = nn.Linear(weight.shape[1], weight.shape[0])
+        layer.weight.data.copy_(weight)
+        layer.bias.data.copy_(bias)
+    decoder.style_projection_layer = layer
+    decoder.clear_style_cache()
+    torch.quantization.quantize_dynamic(decoder, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return generator
+
+
+class StaticQuantConv2d(nn.Module):
+    # conv with int8 weights and activations. quantized convs only support zero padding, so reflect/replicate
+    # padding is applied in float before quantizing the input. the output is dequantized for the following
+    # PixelNorm, which has no quantized counterpart
+    def __init__(self, conv):
+        super(StaticQuantConv2d, self).__init__()
+        self.padding_mode = conv.padding_mode
+        padding = conv.padding if conv.padding_mode == 'zeros' else 0
+        if conv.padding_mode != 'zeros':
+            self.pad = conv._reversed_padding_repeated_twice
+        self.quant = torch.quantization.QuantStub()
+        self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                              padding=padding, dilation=conv.dilation, groups=conv.groups, bias=conv.bias is not None)
+        self.conv.weight.data.copy_(conv.weight.data)
+        if conv.bias is not None:
+            self.conv.bias.data.copy_(conv.bias.data)
+        self.dequant = torch.quantization.DeQuantStub()
+
+    def forward(self, input):
+        if self.padding_mode != 'zeros':
+            input = F.pad(input, self.pad, mode=self.padding_mode)
+        return self.dequant(self.conv(self.quant(input)))
+
+
+def replace_convs(module, qconfig):
+    for name, child in module.named_children():
+        conv = child.conv if isinstance(child, networks.EqualConv2d) else child
+        if isinstance(conv, nn.Conv2d):
+            wrapper = StaticQuantConv2d(conv)
+            wrapper.qconfig = qconfig
+            setattr(module, name, wrapper)
+        else:
+            replace_convs(child, qconfig)
+
+
+def quantize_encoder(id_encoder, calibration_images):
+    # static int8 quantization of the identity encoder convs (including the resnet blocks),
+    # calibrated on a few aligned faces. id_encoder is modified in place
+    engine = set_engine()
+    replace_convs(id_encoder, torch.quantization.get_default_qconfig(engine))
+    id_encoder.cpu().eval()
+    torch.quantization.prepare(id_encoder, inplace=True)
+    with torch.no_grad():
+        for image in calibration_images:
+            id_encoder(image.cpu())
+    torch.quantization.convert(id_encoder, inplace=True)
+    return id_encoder
+
+
+def save_encoder(id_encoder, example_image, path):
+    # quantized modules are saved as TorchScript, which (unlike state dicts) keeps the quantized layer structure
+    with torch.no_grad():
+        traced = torch.jit.trace(id_encoder, example_image.cpu())
+    traced.save(path)
+
+
+def quantize_decoder_weights(decoder):
+    # weight only int8 quantization (symmetric, per output channel) of the modulated conv weights.
+    # activations stay in float and the weights are dequantized once in ModulatedConv2d.scaled_weight,
+    # so the convs still run in fp32: this only reduces the stored weights, it does not reduce latency
+    with torch.no_grad():
+        for conv in decoder.modulated_convs():
+            weight = conv.scaled_weight().detach()
+            scale = weight.abs().view(weight.shape[0], -1).max(1)[0].clamp(min=1e-8) / 127
+            weight_int8 = torch.round(weight / scale.view(-1, 1, 1, 1)).clamp(-127, 127).to(torch.int8)
+            del conv._parameters['weight']
+            conv.weight_int8 = weight_int8
+            conv.weight_scale = scale
+            conv.weight_dequantized = None
+            if conv.demod_weight is not None:
+                conv.demod_weight = (conv.scaled_weight() ** 2).sum(3).sum(2).t().contiguous()
+    decoder.clear_style_cache()
+    return decoder
+
+
+def quantize_generator(generator, parts, graph_dir):
+    # applies the selected quantization parts to a frozen generator. the calibrated encoder is loaded from
+    # graph_dir, where it is written by quantize.py
+    if not getattr(generator, 'frozen', False):
+        networks.freeze_for_inference(generator)
+    if 'mapping' in parts:
+        quantize_mapping(generator)
+    if 'decoder' in parts:
+        quantize_decoder_weights(generator.decoder)
+    if 'encoder' in parts:
+        path = os.path.join(graph_dir, ENCODER_FILE)
+        if not os.path.isfile(path):
+            raise IOError('%s not found, run quantize.py to calibrate the quantized identity encoder' % path)
+        set_engine()
+        generator.id_encoder = torch.jit.load(path, map_location='cpu')
+    return generator
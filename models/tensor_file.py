@@ -0,0 +1,71 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+# flat tensor files in the safetensors layout: an 8 byte little endian header size, a json header that maps
+# every tensor name to its dtype, shape and [begin, end) byte offsets in the data section, and the raw tensor
+# data. the header is padded so the data section starts at ALIGNMENT bytes, and tensors are stored by
+# decreasing element size so every tensor is aligned to its element size. loading maps the file copy-on-write,
+# the tensors are views of the mapping and share the page cache between processes until written to
+import json
+import struct
+import numpy as np
+import torch
+
+EXTENSION = '.safetensors'
+ALIGNMENT = 64
+
+DTYPES = {torch.float32: ('F32', np.float32), torch.float16: ('F16', np.float16),
+          torch.bfloat16: ('BF16', np.int16), torch.int64: ('I64', np.int64),
+          torch.int32: ('I32', np.int32), torch.int16: ('I16', np.int16),
+          torch.int8: ('I8', np.int8), torch.uint8: ('U8', np.uint8), torch.bool: ('BOOL', np.bool_)}
+TORCH_DTYPES = dict((name, dtype) for dtype, (name, _) in DTYPES.items())
+NUMPY_DTYPES = dict(DTYPES.values())
+
+
+def save(path, state_dict, metadata=None):
+    tensors = [(name, tensor.detach().cpu().contiguous()) for name, tensor in state_dict.items() if tensor is not None]
+    tensors.sort(key=lambda item: -item[1].element_size())
+
+    header = {}
+    offset = 0
+    for name, tensor in tensors:
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': DTYPES[tensor.dtype][0], 'shape': list(tensor.shape), 'data_offsets': [offset, offset + size]}
+        offset += size
+    if metadata:
+        header['__metadata__'] = dict((key, str(value)) for key, value in metadata.items())
+
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(8 + len(header)) % ALIGNMENT)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for _, tensor in tensors:
+            if tensor.dtype == torch.bfloat16:
+                tensor = tensor.view(torch.int16)
+            f.write(tensor.numpy().tobytes())
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    metadata = header.pop('__metadata__', {})
+    return header, metadata, 8 + header_size
+
+
+def load(path, dtype=None):
+    # returns the state dict and the metadata of a tensor file. the tensors are copy-on-write views of
+    # the memory mapped file. if dtype is given, tensors of another floating point dtype are converted (copied)
+    header, metadata, data_start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    state_dict = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        array = data[data_start + begin:data_start + end].view(NUMPY_DTYPES[info['dtype']]).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if info['dtype'] == 'BF16':
+            tensor = tensor.view(torch.bfloat16)
+        if dtype is not None and tensor.is_floating_point() and tensor.dtype != dtype:
+            tensor = tensor.to(dtype)
+        state_dict[name] = tensor
+    return state_dict, metadata
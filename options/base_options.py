@@ -74,9 +74,17 @@ class BaseOptions():
             if id >= 0:
                 self.opt.gpu_ids.append(id)
 
-        # set gpu ids
+        # fall back to CPU when CUDA is not available
+        if len(self.opt.gpu_ids) > 0 and not torch.cuda.is_available():
+            print('CUDA is not available, running on CPU')
+            self.opt.gpu_ids = []
+
+        # set gpu ids and the device used by the model and the preprocessor
         if len(self.opt.gpu_ids) > 0:
             torch.cuda.set_device(self.opt.gpu_ids[0])
+            self.opt.device = 'cuda:%d' % self.opt.gpu_ids[0]
+        else:
+            self.opt.device = 'cpu'
 
         # set class specific sort order
         if self.opt.sort_order is not None:
@@ -92,6 +100,19 @@ class BaseOptions():
             for curr_epoch in decay_epochs:
                 self.opt.decay_epochs += [int(curr_epoch)]
 
+        # set traversal schedule
+        if (not self.isTrain) and self.opt.traverse_classes is not None:
+            traverse_classes = self.opt.traverse_classes.split(',')
+            self.opt.traverse_classes = []
+            for curr_class in traverse_classes:
+                self.opt.traverse_classes += [int(curr_class)]
+
+        if (not self.isTrain) and self.opt.segment_frames is not None:
+            segment_frames = self.opt.segment_frames.split(',')
+            self.opt.segment_frames = []
+            for curr_frames in segment_frames:
+                self.opt.segment_frames += [int(curr_frames)]
+
         # create full image paths in traverse/deploy mode
         if (not self.isTrain) and (self.opt.traverse or self.opt.deploy):
             with open(self.opt.image_path_file,'r') as f:
@@ -19,6 +19,31 @@ class TestOptions(BaseOptions):
         self.parser.add_argument('--compare_to_trained_class', type=int, default=1, help='what class to compare to')
         self.parser.add_argument('--trained_class_jump', type=int, default=1, choices=[1,2],help='how many classes to jump')
         self.parser.add_argument('--interp_step', type=float, default=0.5, help='step size of interpolated w space vectors between each 2 true w space vectors')
+        self.parser.add_argument('--interp_easing', type=str, default='linear', choices=['linear','smoothstep','cosine'], help='easing curve applied to the interpolation weights within each traversal segment')
+        self.parser.add_argument('--segment_frames', type=str, default=None, help='comma separated number of frames per traversal segment, e.g. 10,10,20,30,20. overrides interp_step')
+        self.parser.add_argument('--adaptive_frames', type=int, default=0, help='total number of traversal frames distributed over the segments by the pixel change between their keyframes (decodes the keyframes first), 0 uses interp_step. ignored with segment_frames')
+        self.parser.add_argument('--traverse_classes', type=str, default=None, help='comma separated subset of age classes to traverse through, e.g. 0,2,4,5. default is all classes')
+        self.parser.add_argument('--traverse_batch', type=int, default=1, help='number of images of image_path_file rendered together in traverse/deploy mode (test.py, not with make_video)')
+        self.parser.add_argument('--id_cache_size', type=int, default=0, help='number of identity encoder outputs kept in memory (fp16) for re-rendering the same images, 0 disables the cache')
+        self.parser.add_argument('--id_cache_dir', type=str, default='', help='optional directory where cached identity encoder outputs are also stored on disk')
+        self.parser.add_argument('--age_cache_size', type=int, default=64, help='number of frames kept by render_age (continuous age rendering), 0 disables the frame cache')
+        self.parser.add_argument('--age_step', type=float, default=0.5, help='render_age rounds the requested age to a multiple of age_step (years), which is also the resolution of its frame cache')
+        self.parser.add_argument('--decode_chunk', type=int, default=0, help='maximum number of traverse/deploy frames decoded in a single batch, 0 decodes all frames at once. chunked frames are numerically equivalent to a single batch, not necessarily bitwise identical on gpu (cudnn may pick other conv algorithms per batch size)')
+        self.parser.add_argument('--decode_memory_mb', type=int, default=0, help='approximate activation memory budget (MB) of a traverse/deploy decoder batch, 0 means unlimited')
+        self.parser.add_argument('--no_freeze', action='store_true', help='keep the training graph (EqualLR hooks, separate padding layers) instead of freezing the generator for inference')
+        self.parser.add_argument('--modconv_impl', type=str, default='auto', choices=['auto','grouped','shared'], help='modulated conv formulation: grouped conv with per sample weights, a single shared weight conv with modulated activations, or auto (shared for inference batches)')
+        self.parser.add_argument('--backend', type=str, default='eager', choices=['eager','onnx'], help='run traverse/deploy frames with eager pytorch or with the exported graphs on ONNX Runtime (CPU)')
+        self.parser.add_argument('--cpu_workers', type=int, default=0, help='number of cpu worker processes that decode the traverse/deploy frames in parallel (eager backend, float, cpu only), 0 or 1 decodes in this process')
+        self.parser.add_argument('--export_dir', type=str, default='', help='directory of the exported TorchScript/ONNX graphs, default is checkpoints_dir/name/export')
+        self.parser.add_argument('--onnx_threads', type=int, default=0, help='number of ONNX Runtime intra-op threads, 0 keeps the default')
+        self.parser.add_argument('--onnx_opset', type=int, default=13, help='ONNX opset version used by export.py')
+        self.parser.add_argument('--check_parity', action='store_true', help='export.py: compare the exported graphs with the eager generator after exporting')
+        self.parser.add_argument('--precision', type=str, default='fp32', choices=['fp32','fp16','bf16'], help='inference precision, fp16/bf16 run the generator in an autocast region with PixelNorm and demodulation kept in fp32. fp16 falls back to bf16 on cpu')
+        self.parser.add_argument('--quantize', type=str, default='', help='int8 cpu inference: comma separated subset of mapping (dynamic), encoder (static, calibrated by quantize.py), decoder (weight only int8 storage, still computed in fp32, no speedup), or all')
+        self.parser.add_argument('--quantize_models', type=str, default='', help='quantize.py: comma separated model names to calibrate and compare, default is --name')
+        self.parser.add_argument('--calibration_images', type=int, default=8, help='quantize.py: number of images from --image_path_file used to calibrate the quantized encoder')
+        self.parser.add_argument('--load_format', type=str, default='auto', choices=['auto','pth'], help='auto loads a converted .safetensors checkpoint (convert_checkpoint.py) when one exists, pth always loads the pickled checkpoint')
+        self.parser.add_argument('--checkpoint_dtype', type=str, default='fp32', choices=['fp32','fp16','bf16'], help='convert_checkpoint.py: dtype of the stored weights, reduced precision files are converted back to fp32 when loaded')
         self.parser.add_argument('--deploy', action='store_true', help='when true, run forward pass on a list of images')
         self.parser.add_argument('--image_path_file', type=str, help='a file with a list of images to perform run through the network and/or latent space traversal on')
         self.parser.add_argument('--debug_mode', action='store_true', help='when true, all intermediate outputs are saved to the html file')
@@ -14,6 +14,7 @@ except Exception:
     serial = None
 import threading
 import time
+import bisect
 
 ## todo
 # MINMAX距離をスライダーで変更できるように
@@ -67,6 +68,9 @@ class PortraitExperience:
         self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.current_frame = 0
         self.last_shown_frame = -1
+        self.stream_frames = None  # 生成中のフレームを直接再生する場合のフレームリスト
+        self.stream_order = None  # 粗→細の順で生成される場合の各フレームの位置
+        self.stream_rendered = []  # 生成済みのフレーム位置（昇順）
         self.last_video_render_ms = 0
         self.video_refresh_interval_ms = 67
         self.max_fullscreen_width = 1920
@@ -489,6 +493,44 @@ class PortraitExperience:
             self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
             self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
             self.current_frame = 0
+            self.stream_frames = None
+            self.stream_order = None
+
+    def start_frames(self, total_frames, frame_order=None):
+        """動画ファイルを介さず、生成中のフレームを直接受け取って再生する準備を行う
+        frame_order を指定すると、フレームはその順（粗→細）で届くものとして各位置に配置する"""
+        self.stream_order = list(frame_order) if frame_order is not None else None
+        self.stream_frames = [None] * total_frames if frame_order is not None else []
+        self.stream_rendered = []
+        self.total_frames = total_frames
+        self.current_frame = 0
+        self.last_shown_frame = -1
+
+    def append_frames(self, batch):
+        """デコードされたフレーム（RGB, (n, H, W, 3)）を再生リストに追加する"""
+        if self.stream_frames is None:
+            return
+        for frame in batch:
+            frame = np.ascontiguousarray(frame[:, :, ::-1])
+            if self.stream_order is None:
+                self.stream_frames.append(frame)
+                continue
+            index = self.stream_order[len(self.stream_rendered)]
+            self.stream_frames[index] = frame
+            bisect.insort(self.stream_rendered, index)
+
+    def nearest_stream_frame(self, target_frame):
+        """粗→細の生成中に、target_frame に最も近い生成済みフレームの位置を返す"""
+        rendered = self.stream_rendered
+        if not rendered:
+            return -1
+        i = bisect.bisect_left(rendered, target_frame)
+        if i == 0:
+            return rendered[0]
+        if i == len(rendered):
+            return rendered[-1]
+        before, after = rendered[i - 1], rendered[i]
+        return before if target_frame - before <= after - target_frame else after
 
     def set_video(self, path):
         """GUI側から動画パスを設定し、再生準備を行う"""
@@ -504,6 +546,8 @@ class PortraitExperience:
             self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
             self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
             self.current_frame = 0
+            self.stream_frames = None
+            self.stream_order = None
             # コンボボックス表示も同期
             try:
                 base = os.path.basename(path)
@@ -611,7 +655,21 @@ class PortraitExperience:
         target_frame = int(max(0, min(self.total_frames - 1, self.current_frame)))
         ret = False
         video_frame = None
-        if self.last_shown_frame < 0 or abs(target_frame - self.last_shown_frame) > 3:
+        if self.stream_order is not None:
+            # 粗→細の順で生成中のフレームを再生（未生成のフレームは最も近い生成済みフレームで代用）
+            nearest = self.nearest_stream_frame(target_frame)
+            if nearest >= 0:
+                self.last_shown_frame = nearest
+                video_frame = self.stream_frames[nearest]
+                ret = True
+        elif self.stream_frames is not None:
+            # 生成中のフレームを直接再生（未生成のフレームは生成済みの最後のフレームで代用）
+            available = len(self.stream_frames)
+            if available > 0:
+                self.last_shown_frame = min(target_frame, available - 1)
+                video_frame = self.stream_frames[self.last_shown_frame]
+                ret = True
+        elif self.last_shown_frame < 0 or abs(target_frame - self.last_shown_frame) > 3:
             try:
                 self.cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
             except Exception:
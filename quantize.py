@@ -0,0 +1,102 @@
+### Copyright (C) 2020 Roy Or-El. All rights reserved.
+### Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+import os
+import copy
+import time
+import scipy # this is to prevent a potential error caused by importing torch before scipy (happens due to a bad combination of torch & scipy versions)
+import numpy as np
+import torch
+from options.test_options import TestOptions
+from data.data_loader import CreateDataLoader
+from models.models import create_model
+from models import networks
+from models import onnx_backend
+from models import quantization
+import util.util as util
+
+
+def render(model, image):
+    # deploy mode frames (one per age class) of a single image as uint8 arrays
+    with torch.no_grad():
+        start = time.time()
+        frames = model.netG.infer(image.to(model.device), None, deploy=True, target_latent=model.class_latents())
+        elapsed = time.time() - start
+    return util.tensor2im(frames.cpu()).astype(np.float64), elapsed
+
+
+def parts_label(parts):
+    # the decoder part only stores the weights in int8 and still convolves in fp32, so it is marked
+    # as a storage option: it is not expected to contribute to the speedup
+    return ','.join(part + '(storage)' if part == 'decoder' else part for part in parts)
+
+
+def compare(opt, dataset):
+    # calibrates the quantized identity encoder of opt.name, then reports the speedup and the deviation
+    # of the quantized generator from the float generator on the images of opt.image_path_list.
+    # quantize_generator always freezes, so the reference keeps the unfrozen training graph: a broken
+    # freeze then shows up in the reported deviation instead of being part of both outputs
+    parts = quantization.parse_parts(opt.quantize or 'all')
+    opt.quantize = ''
+    # a converted checkpoint may hold frozen weights, so the reference is loaded from the .pth
+    no_freeze, load_format = opt.no_freeze, opt.load_format
+    opt.no_freeze, opt.load_format = True, 'pth'
+    float_model = create_model(opt)
+    float_model.eval()
+    opt.no_freeze, opt.load_format = no_freeze, load_format
+
+    images = [dataset.dataset.get_item_from_path(path)['Imgs'] for path in opt.image_path_list]
+    if 'encoder' in parts:
+        graph_dir = onnx_backend.export_dir(opt)
+        if not os.path.isdir(graph_dir):
+            os.makedirs(graph_dir)
+        calibration_images = images[:opt.calibration_images]
+        # calibrated on the frozen encoder, which is the float graph the quantized generator is built from
+        id_encoder = networks.freeze_for_inference(copy.deepcopy(float_model.netG.id_encoder).cpu())
+        id_encoder = quantization.quantize_encoder(id_encoder, calibration_images)
+        quantization.save_encoder(id_encoder, images[0], os.path.join(graph_dir, quantization.ENCODER_FILE))
+
+    opt.quantize = ','.join(parts)
+    quantized_model = create_model(opt)
+    quantized_model.eval()
+
+    float_time, quantized_time, max_diff, abs_diff, mse = 0, 0, 0, 0, 0
+    for image in images:
+        float_frames, elapsed = render(float_model, image)
+        float_time += elapsed
+        quantized_frames, elapsed = render(quantized_model, image)
+        quantized_time += elapsed
+        diff = quantized_frames - float_frames
+        max_diff = max(max_diff, np.abs(diff).max())
+        abs_diff += np.abs(diff).mean()
+        mse += (diff ** 2).mean()
+
+    n = len(images)
+    psnr = 10 * np.log10(255 ** 2 / max(mse / n, 1e-10))
+    print('%-16s %-34s %10.1f %10.1f %7.2fx %9d %9.2f %8.2f' % (opt.name, parts_label(parts), float_time / n * 1000,
+                                                             quantized_time / n * 1000, float_time / quantized_time,
+                                                             max_diff, abs_diff / n, psnr))
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse(save=False)
+    opt.nThreads = 1
+    opt.batchSize = 1
+    opt.serial_batches = True
+    opt.no_flip = True
+    opt.display_id = 0
+    if opt.device != 'cpu':
+        print('int8 quantization is only supported on cpu, using cpu')
+        opt.gpu_ids = []
+        opt.device = 'cpu'
+
+    data_loader = CreateDataLoader(opt)
+    dataset = data_loader.load_data()
+
+    names = opt.quantize_models.split(',') if opt.quantize_models else [opt.name]
+    quantize = opt.quantize
+    print('%-16s %-34s %10s %10s %8s %9s %9s %8s' % ('model', 'parts', 'fp32(ms)', 'int8(ms)', 'speedup',
+                                                    'max diff', 'mean diff', 'psnr(dB)'))
+    for name in names:
+        opt.name = name
+        opt.quantize = quantize
+        compare(opt, dataset)
@@ -43,14 +43,8 @@ def test(opt):
         if not os.path.isdir(output_dir):
             os.makedirs(output_dir)
 
-        for image_path in opt.image_path_list:
-            print(image_path)
-            data = dataset.dataset.get_item_from_path(image_path)
-            visuals = model.inference(data)
-            if opt.traverse and opt.make_video:
-                out_path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + '.mp4')
-                visualizer.make_video(visuals, out_path)
-            elif opt.traverse or (opt.deploy and opt.full_progression):
+        def save_outputs(visuals, image_path):
+            if opt.traverse or (opt.deploy and opt.full_progression):
                 if opt.traverse and opt.compare_to_trained_outputs:
                     out_path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + '_compare_to_{}_jump_{}.png'.format(opt.compare_to_trained_class, opt.trained_class_jump))
                 else:
@@ -59,6 +53,36 @@ def test(opt):
             else:
                 out_path = os.path.join(output_dir, os.path.basename(image_path[:-4]))
                 visualizer.save_images_deploy(visuals, out_path)
+
+        # images are rendered traverse_batch at a time, videos are streamed one image at a time
+        batch_size = 1 if opt.traverse and opt.make_video else max(opt.traverse_batch, 1)
+        for start in range(0, len(opt.image_path_list), batch_size):
+            image_paths = opt.image_path_list[start:start + batch_size]
+            if batch_size > 1:
+                print('\n'.join(image_paths))
+                data = dataset.dataset.get_items_from_paths(image_paths)
+                valid_paths = [path for path, valid in zip(data['Paths'], data['Valid']) if valid]
+                for image_path, visuals in zip(valid_paths, model.inference_batch(data)):
+                    save_outputs(visuals, image_path)
+                continue
+
+            image_path = image_paths[0]
+            print(image_path)
+            data = dataset.dataset.get_item_from_path(image_path)
+            if opt.traverse and opt.make_video:
+                # stream the frames to the video writer while they are decoded
+                visual, frames = model.inference_stream(data)
+                out_path = os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + '.mp4')
+                frames = util.BackgroundGenerator(frames)
+                try:
+                    visualizer.write_stream(frames, video_path=out_path)
+                finally:
+                    # stops the decoding thread when writing fails
+                    frames.close()
+                continue
+
+            visuals = model.inference(data)
+            save_outputs(visuals, image_path)
     else:
         webpage = html.HTML(web_dir, 'Experiment = %s, Phase = %s, Epoch = %s' % (opt.name, opt.phase, opt.which_epoch))
 
@@ -0,0 +1,33 @@
+import sys
+import pytest
+
+
+@pytest.fixture
+def make_opt(tmp_path, monkeypatch):
+    # test options of a small model with random weights in a temporary checkpoints dir. the dataset is
+    # not built, so numClasses is set here instead of by CreateDataLoader
+    torch = pytest.importorskip('torch')
+    from options.test_options import TestOptions
+    from models import networks
+
+    def make(*args):
+        argv = ['test', '--checkpoints_dir', str(tmp_path), '--name', 'model', '--gpu_ids', '-1',
+                '--ngf', '16', '--fineSize', '64', '--no_moving_avg'] + list(args)
+        monkeypatch.setattr(sys, 'argv', argv)
+        opt = TestOptions().parse(save=False)
+        opt.numClasses = 6
+
+        checkpoint = tmp_path / opt.name / ('%s_net_G.pth' % opt.which_epoch)
+        if not checkpoint.exists():
+            checkpoint.parent.mkdir(parents=True, exist_ok=True)
+            torch.manual_seed(0)
+            netG = networks.define_G(opt.input_nc, opt.output_nc, opt.ngf, n_downsample_global=opt.n_downsample,
+                                     id_enc_norm=opt.id_enc_norm, style_dim=opt.gen_dim_per_style * opt.numClasses,
+                                     init_type='kaiming', conv_weight_norm=opt.conv_weight_norm,
+                                     decoder_norm=opt.decoder_norm, activation=opt.activation,
+                                     adaptive_blocks=opt.n_adaptive_blocks, normalize_mlp=opt.normalize_mlp,
+                                     modulated_conv=opt.use_modulated_conv)
+            torch.save(netG.state_dict(), str(checkpoint))
+        return opt
+
+    return make
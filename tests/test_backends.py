@@ -0,0 +1,100 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+from models.models import create_model
+from models import onnx_backend
+import util.util as util
+
+
+def render(net, model, image):
+    # deploy mode frames of every age class
+    with torch.no_grad():
+        latent = model.netG.map_styles(model.make_conditions(torch.arange(model.numClasses)))
+        return net.infer(image, None, deploy=True, target_latent=latent)
+
+
+def test_eager_backend_is_not_registered_twice(make_opt):
+    model = create_model(make_opt())
+    assert model.frame_net is model.netG
+    assert not any(key.startswith('frame_net.') for key in model.state_dict())
+
+
+def export_model(make_opt, tmp_path, image=None):
+    # exports the graphs of a random model with the grouped modulated conv formulation and returns its options
+    # and the eager frames of image, rendered before the export
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    import export
+
+    opt = make_opt('--export_dir', str(tmp_path / 'export'), '--modconv_impl', 'grouped')
+    (tmp_path / 'export').mkdir()
+    eager_model = create_model(opt)
+    expected = render(eager_model.netG, eager_model, image) if image is not None else None
+    export.export(opt, eager_model, opt.export_dir)
+    # exporting traces the shared formulation on a copy and keeps the generator's own
+    assert all(conv.impl == 'grouped' for conv in eager_model.netG.decoder.modulated_convs())
+    return opt, expected
+
+
+def test_onnx_backend(make_opt, tmp_path):
+    image = torch.rand(1, 3, 64, 64) * 2 - 1
+    opt, expected = export_model(make_opt, tmp_path, image)
+    opt.backend = 'onnx'
+    model = create_model(opt)
+    assert isinstance(model.frame_net, onnx_backend.OnnxGenerator)
+
+    out = render(model.frame_net, model, image)
+    assert out.shape == expected.shape
+    assert (out - expected).abs().max().item() < 1e-3
+
+
+def test_onnx_backend_identity_cache(make_opt, tmp_path):
+    opt, _ = export_model(make_opt, tmp_path)
+    opt.backend = 'onnx'
+    model = create_model(opt)
+    model.set_identity_cache(util.IdentityFeatureCache())
+
+    image = torch.rand(1, 3, opt.fineSize, opt.fineSize) * 2 - 1
+    first = render(model.frame_net, model, image)
+    assert len(model.netG.id_cache.entries) == 1
+    second = render(model.frame_net, model, image)
+    assert len(model.netG.id_cache.entries) == 1
+    assert torch.equal(first, second)
+
+
+def test_cpu_workers_backend(make_opt):
+    from models import cpu_executor
+
+    opt = make_opt('--cpu_workers', '2')
+    model = create_model(opt)
+    try:
+        assert isinstance(model.frame_net, cpu_executor.ShardedGenerator)
+        assert not any(key.startswith('frame_net.') for key in model.state_dict())
+
+        image = torch.rand(1, 3, opt.fineSize, opt.fineSize) * 2 - 1
+        expected = render(model.netG, model, image)
+        out = render(model.frame_net, model, image)
+        assert out.shape == expected.shape
+        assert (out - expected).abs().max().item() < 1e-4
+    finally:
+        model.frame_net.close()
+
+
+def test_cpu_workers_skip_abandoned_jobs(make_opt):
+    opt = make_opt('--cpu_workers', '2')
+    model = create_model(opt)
+    try:
+        image = torch.rand(1, 3, opt.fineSize, opt.fineSize) * 2 - 1
+        latent = model.netG.map_styles(model.make_conditions(torch.arange(model.numClasses)))
+        latent = latent.repeat(4, 1)
+        # a stream that is closed after its first shard, its remaining shards are dropped by the workers
+        stream = model.frame_net.iter_infer(image, latent, chunk_size=1)
+        next(stream)
+        stream.close()
+        assert model.frame_net.current_job.value == 0
+
+        expected = render(model.netG, model, image)
+        out = render(model.frame_net, model, image)
+        assert (out - expected).abs().max().item() < 1e-4
+    finally:
+        model.frame_net.close()
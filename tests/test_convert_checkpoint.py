@@ -0,0 +1,19 @@
+import os
+import pytest
+
+torch = pytest.importorskip('torch')
+import convert_checkpoint
+from models.models import create_model
+
+
+def test_converted_checkpoint_matches_pth(make_opt):
+    opt = make_opt('--load_format', 'pth')
+    model = create_model(opt)
+    path = convert_checkpoint.convert(opt, model)
+    assert os.path.isfile(path)
+
+    opt.load_format = 'auto'
+    converted_model = create_model(opt)
+    assert getattr(converted_model.netG, 'frozen', False)
+    assert set(converted_model.netG.state_dict()) == set(model.netG.state_dict())
+    assert convert_checkpoint.max_difference(model, converted_model) < 1e-5
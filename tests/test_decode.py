@@ -0,0 +1,28 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+from models import networks
+
+
+def test_chunked_decode_matches_single_batch():
+    torch.manual_seed(0)
+    netG = networks.define_G(3, 3, 16, id_enc_norm='pixel', conv_weight_norm=True, decoder_norm='pixel',
+                             normalize_mlp=True, modulated_conv=True).eval()
+    input = torch.rand(1, 3, 64, 64) * 2 - 1
+    latent = torch.randn(7, 256)
+    with torch.no_grad():
+        expected = netG.infer(input, None, deploy=True, target_latent=latent, chunk_size=0)
+        out = netG.infer(input, None, deploy=True, target_latent=latent, chunk_size=3)
+        streamed = torch.cat([frames for _, frames in netG.iter_infer(input, latent, chunk_size=3)], 0)
+
+    assert out.shape == expected.shape == (7, 3, 64, 64)
+    assert torch.allclose(out, expected, atol=1e-5)
+    assert torch.allclose(streamed, expected, atol=1e-5)
+
+
+def test_style_cache_keys():
+    latent = torch.randn(4, 256)
+    key = networks.style_cache_key(latent)
+    assert networks.style_cache_key(latent.clone()) == key
+    latent[0] += 1
+    assert networks.style_cache_key(latent) != key
@@ -0,0 +1,43 @@
+import copy
+import pytest
+
+torch = pytest.importorskip('torch')
+from torch import nn
+from models import networks
+
+
+def build_generator():
+    torch.manual_seed(0)
+    netG = networks.define_G(3, 3, 16, id_enc_norm='pixel', conv_weight_norm=True, decoder_norm='pixel',
+                             normalize_mlp=True, modulated_conv=True)
+    return netG.eval()
+
+
+def test_fold_padding_with_shared_activation():
+    # the same activation module appears twice, so children() would return one module less than the Sequential holds
+    torch.manual_seed(0)
+    relu = nn.ReLU()
+    model = nn.Sequential(nn.ReflectionPad2d(1), nn.Conv2d(3, 4, 3), relu,
+                          nn.ReflectionPad2d(1), nn.Conv2d(4, 4, 3), relu).eval()
+    input = torch.randn(2, 3, 16, 16)
+    with torch.no_grad():
+        expected = model(input)
+        networks.fold_padding(model)
+        out = model(input)
+
+    assert not any(isinstance(m, nn.ReflectionPad2d) for m in model)
+    assert out.shape == expected.shape
+    assert torch.allclose(out, expected, atol=1e-6)
+
+
+def test_frozen_generator_matches_unfrozen():
+    netG = build_generator()
+    frozen = networks.freeze_for_inference(copy.deepcopy(netG))
+    input = torch.rand(1, 3, 64, 64) * 2 - 1
+    latent = torch.randn(3, 256)
+    with torch.no_grad():
+        expected = netG.infer(input, None, deploy=True, target_latent=latent)
+        out = frozen.infer(input, None, deploy=True, target_latent=latent)
+
+    assert out.shape == expected.shape == (3, 3, 64, 64)
+    assert (out - expected).abs().max().item() < 1e-4
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('torch')
+import util.util as util
+
+
+def test_background_generator_close_stops_producer():
+    closed = []
+
+    def produce():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.append(True)
+
+    frames = util.BackgroundGenerator(produce(), max_prefetch=1)
+    assert next(frames) == 0
+    frames.close()
+    assert not frames.is_alive()
+    assert closed == [True]
+    assert frames.generator is None
+    assert list(frames) == []
+
+
+def test_background_generator_forwards_errors():
+    def produce():
+        yield 0
+        raise ValueError('decode failed')
+
+    frames = util.BackgroundGenerator(produce())
+    assert next(frames) == 0
+    with pytest.raises(ValueError):
+        next(frames)
+    frames.close()
+    assert not frames.is_alive()
@@ -19,8 +19,9 @@ deeplab_classes = ['background' ,'skin','nose','eye_g','l_eye','r_eye','l_brow',
 
 
 class preprocessInTheWildImage():
-    def __init__(self, out_size=256):
+    def __init__(self, out_size=256, device='cpu'):
         self.out_size = out_size
+        self.device = torch.device(device)
 
         # load landmark detector models
         self.detector = dlib.get_frontal_face_detector()
@@ -39,8 +40,8 @@ class preprocessInTheWildImage():
         self.deeplab_input_size = 513
 
         # load deeplab model
-        assert torch.cuda.is_available()
-        torch.backends.cudnn.benchmark = True
+        if self.device.type == 'cuda':
+            torch.backends.cudnn.benchmark = True
         if not os.path.isfile(resnet_file_path):
             print('Cannot find DeeplabV3 backbone Resnet model.\n' \
                   'Please run download_models.py to download the model')
@@ -59,7 +60,7 @@ class preprocessInTheWildImage():
                   'Please run download_models.py to download the model')
             raise OSError
 
-        checkpoint = torch.load(model_fname)
+        checkpoint = torch.load(model_fname, map_location='cpu')
         state_dict = {k[7:]: v for k, v in checkpoint['state_dict'].items() if 'tracked' not in k}
         self.deeplab_model.load_state_dict(state_dict)
 
@@ -170,8 +171,8 @@ class preprocessInTheWildImage():
     def get_segmentation_maps(self, img):
         img = img.resize((self.deeplab_input_size,self.deeplab_input_size),Image.BILINEAR)
         img = self.deeplab_data_transform(img)
-        img = img.cuda()
-        self.deeplab_model.cuda()
+        img = img.to(self.device)
+        self.deeplab_model.to(self.device)
         outputs = self.deeplab_model(img.unsqueeze(0))
         self.deeplab_model.cpu()
         _, pred = torch.max(outputs, 1)
@@ -5,9 +5,13 @@ import html
 import glob
 import uuid
 import hashlib
+import collections
+import collections.abc
 import requests
 import torch
 import zipfile
+import queue
+import threading
 import numpy as np
 from tqdm import tqdm
 from PIL import Image
@@ -30,28 +34,208 @@ predictor_file_spec = dict(file_url='https://drive.google.com/uc?id=1fhq5lvWy-rj
                            alt_url='https://grail.cs.washington.edu/projects/lifespan_age_transformation_synthesis/pretrained_models/shape_predictor_68_face_landmarks.dat',
                            file_path='util/shape_predictor_68_face_landmarks.dat', file_size=99693937, file_md5='73fde5e05226548677a050913eed4e04')
 
+# channels last layout of 2 to 5 dimensional image tensors (a single image batch is squeezed)
+CHANNELS_LAST = {2: (0, 1), 3: (1, 2, 0), 4: (0, 2, 3, 1), 5: (0, 1, 3, 4, 2)}
+
+# rescales a [-1, 1] image tensor to [0, 255] and moves the channels last on the tensor's device.
+# with uint8 the cast (truncation, as numpy's astype) also happens on the device, so only a
+# quarter of the float data has to be copied to the host
+def tensor2uint8(image_tensor, dtype=torch.uint8):
+    image_tensor = image_tensor.detach()
+    if image_tensor.dim() == 4 and image_tensor.size(0) == 1:
+        image_tensor = image_tensor[0]
+    image_tensor = (image_tensor.float() + 1) / 2.0 * 255.0
+    return image_tensor.to(dtype).permute(CHANNELS_LAST[image_tensor.dim()]).contiguous()
+
 # Converts a Tensor into a Numpy array
 # |imtype|: the desired type of the converted numpy array
 def tensor2im(image_tensor, imtype=np.uint8, normalize=True):
-    im_sz = image_tensor.size()
-    ndims = image_tensor.dim()
-    if ndims == 2:
-        image_numpy = image_tensor.cpu().float().numpy()
-        image_numpy = (image_numpy + 1) / 2.0 * 255.0
-    elif ndims == 3:
-        image_numpy = image_tensor.cpu().float().numpy()
-        image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0
-    elif ndims == 4 and im_sz[0] == 1:
-        image_numpy = image_tensor[0].cpu().float().numpy()
-        image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0
-    elif ndims == 4:
-        image_numpy = image_tensor.cpu().float().numpy()
-        image_numpy = (np.transpose(image_numpy, (0, 2, 3, 1)) + 1) / 2.0 * 255.0
-    else: # ndims == 5
-        image_numpy = image_tensor.cpu().float().numpy()
-        image_numpy = (np.transpose(image_numpy, (0, 1, 3, 4, 2)) + 1) / 2.0 * 255.0
-
-    return image_numpy.astype(imtype)
+    if imtype == np.uint8:
+        return tensor2uint8(image_tensor).cpu().numpy()
+    return tensor2uint8(image_tensor, torch.float32).cpu().numpy().astype(imtype)
+
+class BackgroundGenerator(threading.Thread):
+    # runs a generator in a background thread and buffers up to max_prefetch of its items,
+    # so that producing the next item (e.g. decoding frames) overlaps with consuming the current one.
+    # a consumer that stops early (e.g. a failed video write) calls close(), which stops the thread
+    # and closes the generator instead of leaving both blocked on the full queue
+    def __init__(self, generator, max_prefetch=2):
+        super(BackgroundGenerator, self).__init__(daemon=True)
+        self.generator = generator
+        self.queue = queue.Queue(max_prefetch)
+        self.stopped = threading.Event()
+        self.exhausted = False
+        self.start()
+
+    def run(self):
+        try:
+            for item in self.generator:
+                self.queue.put((item, None))
+                if self.stopped.is_set():
+                    break
+        except Exception as e:
+            self.queue.put((None, e))
+        if self.stopped.is_set() and hasattr(self.generator, 'close'):
+            # runs the generator's cleanup in this thread, where it was suspended
+            try:
+                self.generator.close()
+            except Exception:
+                pass
+        # drops the suspended generator (and the buffers and model it references)
+        self.generator = None
+        self.queue.put((StopIteration, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.exhausted:
+            raise StopIteration
+        item, error = self.queue.get()
+        if error is not None:
+            self.exhausted = True
+            raise error
+        if item is StopIteration:
+            self.exhausted = True
+            raise StopIteration
+        return item
+
+    def close(self):
+        # stops producing and waits for the thread, draining the queue so that a blocked put returns
+        self.stopped.set()
+        self.exhausted = True
+        while self.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+def tensor_key(input, name=''):
+    # content hash of a tensor (and its shape), qualified by name
+    data = input.detach().float().cpu().contiguous().numpy()
+    digest = hashlib.sha1(data.tobytes())
+    digest.update(('%s %s' % (name, tuple(data.shape))).encode('utf-8'))
+    return digest.hexdigest()
+
+class IdentityFeatureCache(object):
+    # LRU cache of identity encoder outputs keyed by the content of the preprocessed input image and
+    # the model name. features are stored in fp16; with cache_dir they are also written to disk so they
+    # survive model reloads and restarts. the cache is independent of the model, so it can outlive it
+    def __init__(self, max_entries=32, cache_dir=''):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = collections.OrderedDict()
+        if cache_dir:
+            mkdir(cache_dir)
+
+    def key(self, input, model_name):
+        return tensor_key(input, model_name)
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, key + '.pt')
+            if os.path.isfile(path):
+                features = torch.load(path, map_location='cpu')
+                self.add(key, features)
+                return features
+        return None
+
+    def put(self, key, features):
+        # stores features (fp16, on the cpu) and returns the stored tensor
+        features = features.detach().half().cpu()
+        self.add(key, features)
+        if self.cache_dir:
+            torch.save(features, os.path.join(self.cache_dir, key + '.pt'))
+        return features
+
+    def add(self, key, features):
+        self.entries[key] = features
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class BufferArena(object):
+    # named tensors that are reused by later requests of the same shape, dtype and device instead of
+    # being allocated again, and pinned host buffers for copying results off the gpu. a buffer is
+    # overwritten by the next request that uses its name, so its contents must be consumed before
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=torch.float32, device='cpu', pin_memory=False):
+        shape = torch.Size(shape)
+        device = torch.device(device)
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype or buffer.device != device:
+            buffer = torch.empty(shape, dtype=dtype, device=device, pin_memory=pin_memory)
+            self.buffers[name] = buffer
+        return buffer
+
+    def to_host(self, tensor, name):
+        # copies a gpu tensor into the pinned host buffer name, cpu tensors are returned as they are
+        if not tensor.is_cuda:
+            return tensor
+        host = self.get('host_' + name, tensor.shape, tensor.dtype, 'cpu', pin_memory=True)
+        host.copy_(tensor, non_blocking=True)
+        torch.cuda.current_stream(tensor.device).synchronize()
+        return host
+
+    def clear(self):
+        self.buffers = {}
+
+class Visuals(collections.abc.Mapping):
+    # traverse/deploy visuals of one image: the frames as a single contiguous (n, H, W, 3) uint8 array and the
+    # named input images (orig_img, paper_orig_img). frame_indices holds the traversal index of every frame when
+    # only some frames were rendered, num_frames the length of the whole traversal. frames are read directly
+    # (frames, frame(index)); the mapping interface with tex_trans_to_class_<index> keys matches the visuals dicts
+    FRAME_PREFIX = 'tex_trans_to_class_'
+
+    def __init__(self, frames, images=(), frame_indices=None, num_frames=None):
+        self.frames = frames
+        self.images = collections.OrderedDict(images)
+        self.frame_indices = list(frame_indices) if frame_indices is not None else list(range(len(frames)))
+        self.num_frames = num_frames if num_frames is not None else (max(self.frame_indices) + 1 if self.frame_indices else 0)
+        self.positions = dict((index, i) for i, index in enumerate(self.frame_indices))
+
+    @classmethod
+    def from_dict(cls, visual, num_frames=None):
+        if isinstance(visual, cls):
+            return visual if num_frames is None else cls(visual.frames, visual.images, visual.frame_indices, num_frames)
+        prefix = cls.FRAME_PREFIX
+        images = [(label, image) for label, image in visual.items() if not label.startswith(prefix)]
+        frame_indices = sorted(int(label[len(prefix):]) for label in visual if label.startswith(prefix))
+        frames = np.stack([visual[prefix + str(index)] for index in frame_indices]) if frame_indices else None
+        return cls(frames, images, frame_indices, num_frames)
+
+    def frame(self, index):
+        # frame at traversal index, None if it was not rendered
+        position = self.positions.get(index)
+        return self.frames[position] if position is not None else None
+
+    def copy(self):
+        return Visuals(self.frames, self.images, self.frame_indices, self.num_frames)
+
+    def __getitem__(self, label):
+        if label in self.images:
+            return self.images[label]
+        if label.startswith(self.FRAME_PREFIX) and label[len(self.FRAME_PREFIX):].isdigit():
+            frame = self.frame(int(label[len(self.FRAME_PREFIX):]))
+            if frame is not None:
+                return frame
+        raise KeyError(label)
+
+    def __iter__(self):
+        for label in self.images:
+            yield label
+        for index in self.frame_indices:
+            yield self.FRAME_PREFIX + str(index)
+
+    def __len__(self):
+        return len(self.images) + len(self.frame_indices)
 
 def save_image(image_numpy, image_path):
     image_pil = Image.fromarray(image_numpy)
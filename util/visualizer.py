@@ -134,52 +134,107 @@ table td {width: %dpx; height: %dpx; padding: 4px; outline: 4px solid black}
         util.save_image(matrix_img, image_path)
 
     def save_row_image(self, visuals, image_path, traverse=False):
-        visual = visuals[0]
+        visual = util.Visuals.from_dict(visuals[0])
         orig_img = visual['orig_img']
         h, w, c = orig_img.shape
-        traversal_img = np.concatenate((orig_img, np.full((h, 10, c), 255, dtype=np.uint8)), 1)
-        if traverse:
-            out_classes = len(visual) - 1
-        else:
-            out_classes = self.numClasses
-        for cls in range(out_classes):
-            next_im = visual['tex_trans_to_class_' + str(cls)]
-            traversal_img = np.concatenate((traversal_img, next_im), 1)
+        frames = visual.frames if traverse else visual.frames[:self.numClasses]
+        # the frames are laid out side by side: (n, h, w, c) -> (h, n * w, c)
+        frames = frames.transpose(1, 0, 2, 3).reshape(h, -1, c)
+        traversal_img = np.concatenate((orig_img, np.full((h, 10, c), 255, dtype=np.uint8), frames), 1)
 
         util.save_image(traversal_img, image_path)
 
     def make_video(self, visuals, video_path):
-        fps = 20#25
-        visual = visuals[0]
-        orig_img = visual['orig_img']
-        h, w = orig_img.shape[0], orig_img.shape[1]
-        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w,h))
-        out_classes = len(visual) - 1
-        for cls in range(out_classes):
-            next_im = visual['tex_trans_to_class_' + str(cls)]
-            writer.write(next_im[:,:,::-1])
-
-        writer.release()
+        self.write_stream(self.iter_frames(visuals), video_path=video_path)
 
     def save_frame_images(self, visuals, output_dir):
         visual = visuals[0]
-        orig_img = visual['orig_img']
-        
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        
-        out_classes = len(visual) - 1
-        
-        util.save_image(orig_img, os.path.join(output_dir, 'frame_000_original.png'))
-        
-        for cls in range(out_classes):
-            next_im = visual['tex_trans_to_class_' + str(cls)]
-            frame_filename = f'frame_{cls+1:03d}.png'
-            frame_path = os.path.join(output_dir, frame_filename)
-            util.save_image(next_im, frame_path)
+        self.write_stream(self.iter_frames(visuals), frame_dir=output_dir, orig_img=visual['orig_img'])
+
+    # yields the traversal frames of visuals as a single (n, H, W, 3) batch, in the same form as
+    # the frame stream of InferenceModel.inference_stream
+    def iter_frames(self, visuals):
+        visual = util.Visuals.from_dict(visuals[0])
+        if visual.frames is not None:
+            yield visual.frames
+
+    # consumes a stream of uint8 frame batches of shape (n, H, W, 3) once, writing every batch to the
+    # video and/or the frame images as soon as it arrives. |callbacks| are called with every batch.
+    # when keep_frames is true the frames are also returned as a list (in traversal order).
+    # frame_order holds the traversal index of every streamed frame when the frames arrive out of order
+    # (see LATS_model.inference_stream with progressive): frame images are written on arrival under their
+    # traversal index, the video only holds back the frames that arrive before one of their predecessors
+    def write_stream(self, frames, video_path=None, frame_dir=None, orig_img=None, keep_frames=False, callbacks=(),
+                     fps=20, frame_order=None):
+        writer = None
+        kept_frames = [None] * len(frame_order) if frame_order is not None else []
+        if frame_dir is not None:
+            if not os.path.exists(frame_dir):
+                os.makedirs(frame_dir)
+            if orig_img is not None:
+                util.save_image(orig_img, os.path.join(frame_dir, 'frame_000_original.png'))
+
+        count = 0
+        # video frames waiting for a predecessor, by traversal index
+        pending = {}
+        next_index = 0
+        try:
+            for batch in frames:
+                if video_path is not None and writer is None:
+                    h, w = batch.shape[1], batch.shape[2]
+                    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w,h))
+                for next_im in batch:
+                    index = frame_order[count] if frame_order is not None else count
+                    if writer is not None:
+                        pending[index] = next_im
+                        while next_index in pending:
+                            writer.write(pending.pop(next_index)[:,:,::-1])
+                            next_index += 1
+                    if frame_dir is not None:
+                        frame_filename = f'frame_{index+1:03d}.png'
+                        util.save_image(next_im, os.path.join(frame_dir, frame_filename))
+                    if keep_frames:
+                        if frame_order is not None:
+                            kept_frames[index] = next_im
+                        else:
+                            kept_frames.append(next_im)
+                    count += 1
+                for callback in callbacks:
+                    callback(batch)
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if keep_frames:
+            return kept_frames
+
+    # builds the visuals list of a traversal from the visuals dict of the input image and its frames
+    # frame_indices holds the traversal index of every frame when only a subset of the frames was rendered
+    def frames_to_visuals(self, visual, frames, frame_indices=None, num_frames=None):
+        return [util.Visuals(np.stack(frames), visual, frame_indices, num_frames)]
+
+    # indices of the frames of a traversal with num_frames frames that are shown in the paper image
+    def paper_frame_indices(self, num_frames):
+        if num_frames >= 5:
+            indices = [
+                0,
+                num_frames // 5,
+                num_frames // 4,
+                num_frames // 3,
+                num_frames // 2,
+                (num_frames * 2) // 3,
+                (num_frames * 3) // 4,
+                (num_frames * 4) // 5,
+                num_frames - 1
+            ]
+        else:
+            indices = list(range(min(5, num_frames)))
+        return indices
 
-    def save_paper_image(self, visuals, image_path, include_original=True):
-        visual = visuals[0]
+    # num_frames is the number of frames of the whole traversal, needed when visuals only hold the
+    # frames of paper_frame_indices
+    def save_paper_image(self, visuals, image_path, include_original=True, num_frames=None):
+        visual = util.Visuals.from_dict(visuals[0], num_frames)
         orig_img = visual['orig_img']
         
         # 論文用画像でオリジナル背景保持が設定されている場合は専用の画像を使用
@@ -190,33 +245,17 @@ table td {width: %dpx; height: %dpx; padding: 4px; outline: 4px solid black}
         
         h, w, c = orig_img.shape
         
-        out_classes = len(visual) - 1
-        # paper_orig_imgがあれば1つ分を差し引く
-        if 'paper_orig_img' in visual:
-            out_classes -= 1
+        out_classes = visual.num_frames
         
         gap_width = 30
         overlap_width = 50  # 画像同士のオーバーラップ幅（グレー領域を考慮）
         
         selected_frames = []
-        if out_classes >= 5:
-            indices = [
-                0,
-                out_classes // 5,
-                out_classes // 4,
-                out_classes // 3,
-                out_classes // 2,
-                (out_classes * 2) // 3,
-                (out_classes * 3) // 4,
-                (out_classes * 4) // 5,
-                out_classes - 1
-            ]
-        else:
-            indices = list(range(min(5, out_classes)))
+        indices = self.paper_frame_indices(out_classes)
         
         for idx in indices:
             if idx < out_classes:
-                selected_frames.append(visual['tex_trans_to_class_' + str(idx)])
+                selected_frames.append(visual.frame(idx))
         
         # オーバーラップを考慮した全体幅を計算
         if len(selected_frames) > 0: